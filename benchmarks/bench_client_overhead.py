@@ -0,0 +1,75 @@
+"""
+Measure pybedquilt's own overhead per operation: argument checks, json
+encoding, cursor creation and decoding and unpacking rows. Runs the
+client against fakedb, an in-process stand-in for the server which
+answers instantly with canned rows, so no database is needed.
+
+Usage: python benchmarks/bench_client_overhead.py [iterations] [--prepare]
+"""
+import sys
+import pybedquilt
+import common
+import fakedb
+
+
+COLLECTION = 'bench_overhead'
+
+
+def doc(n):
+    return {'_id': 'doc{}'.format(n), 'n': n, 'color': 'red',
+            'tags': ['a', 'b', 'c'], 'nested': {'x': n, 'y': [1, 2, 3]}}
+
+
+def fake_client(**kwargs):
+    fakedb.install()
+    server = fakedb.FakeServer()
+    server.respond('bq_find_one_by_id', fakedb.jsonb_rows([doc(1)]))
+    server.respond('bq_find_one(', fakedb.jsonb_rows([doc(1)]))
+    server.respond('bq_find(', lambda query, params: (
+        LARGE if params[-2] is None else SMALL))
+    server.respond('bq_insert', [('doc1',)])
+    server.respond('bq_save', [('doc1',)])
+    server.respond('bq_count', [(10,)])
+    server.respond('bq_remove_many_by_ids', [(10,)])
+    server.respond('bq_distinct', [('red',), ('blue',)])
+    return pybedquilt.BedquiltClient(server.dsn, **kwargs)
+
+
+SMALL = fakedb.jsonb_rows([doc(n) for n in range(10)])
+LARGE = fakedb.jsonb_rows([doc(n) for n in range(1000)])
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    iterations = int(args[0]) if args else 10000
+    coll = fake_client(prepare='--prepare' in sys.argv)[COLLECTION]
+    ids = ['doc{}'.format(n) for n in range(10)]
+
+    cases = [
+        ('find_one_by_id', lambda: coll.find_one_by_id('doc1')),
+        ('find_one', lambda: coll.find_one({'color': 'red'})),
+        ('find 10 docs', lambda: list(coll.find({'color': 'red'},
+                                                limit=10))),
+        ('find 1000 docs', lambda: list(coll.find({'color': 'red'}))),
+        ('insert', lambda: coll.insert(doc(1))),
+        ('save', lambda: coll.save(doc(1))),
+        ('count', lambda: coll.count({'color': 'red'})),
+        ('distinct', lambda: list(coll.distinct('color'))),
+        ('remove_many_by_ids', lambda: coll.remove_many_by_ids(ids)),
+    ]
+    for label, fn in cases:
+        # fewer rounds of the cases which decode many documents
+        count = iterations // 100 if label == 'find 1000 docs' else iterations
+        latencies = []
+        for _ in range(max(count, 1)):
+            start = common.clock()
+            fn()
+            latencies.append(common.clock() - start)
+        stats = common.latency_stats(latencies)
+        print('{:<30} {:>12,.0f} ops/sec  p50 {:>8.1f}us  p99 {:>8.1f}us'
+              .format(label, stats['ops_per_sec'],
+                      stats['p50_ms'] * 1000, stats['p99_ms'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
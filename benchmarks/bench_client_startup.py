@@ -0,0 +1,46 @@
+"""
+Measure the time from creating a client to the result of its first
+query, for cold clients (the first for a server in this process, which
+must check the bedquilt extension), warm clients (the extension check
+is cached) and lazy clients (warm, and connecting on the first query).
+
+Usage: python benchmarks/bench_client_startup.py [iterations]
+"""
+import sys
+import common
+from pybedquilt import core
+
+
+COLLECTION = 'bench_client_startup'
+
+
+def first_query(iterations, cold=False, **kwargs):
+    for _ in range(iterations):
+        if cold:
+            core._BOOTSTRAPPED.clear()
+        client = common.get_client(**kwargs)
+        client[COLLECTION].count()
+        client.close()
+    return iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    client = common.get_client()
+    common.fresh_collection(client, COLLECTION)
+
+    for label, kwargs in [('cold', {'cold': True}),
+                          ('warm', {}),
+                          ('warm lazy', {'lazy': True}),
+                          ('cold pool_size=4', {'cold': True,
+                                                'pool_size': 4}),
+                          ('warm pool_size=4', {'pool_size': 4})]:
+        elapsed, _ = common.timed(first_query, iterations, **kwargs)
+        print('{:<30} {:>8.1f} us to first query'.format(
+            label, elapsed / iterations * 1e6))
+
+    client.delete_collection(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
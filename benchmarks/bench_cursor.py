@@ -0,0 +1,67 @@
+"""
+Compare the rows/sec of iterating a large find() result one row at a
+time against the batched BedquiltCursor iteration.
+
+Usage: python benchmarks/bench_cursor.py [row-count]
+"""
+import sys
+import json
+import common
+from pybedquilt.core import _unpack_row
+
+
+COLLECTION = 'bench_cursor'
+
+
+def per_row(client):
+    # The pre-batching code path: fetchone() and _unpack_row() per document
+    with client._connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+        select bq_find(%s, %s::jsonb, %s, %s, %s::jsonb);
+        """, (COLLECTION, json.dumps({}), 0, None, None))
+        count = 0
+        row = cursor.fetchone()
+        while row:
+            _unpack_row(row)
+            count += 1
+            row = cursor.fetchone()
+    return count
+
+
+def iterate(client, stream):
+    count = 0
+    for _ in client[COLLECTION].find(stream=stream):
+        count += 1
+    return count
+
+
+def iterate_batches(client, stream):
+    count = 0
+    for batch in client[COLLECTION].find(stream=stream).iter_batches():
+        count += len(batch)
+    return count
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    client = common.get_client()
+    common.fresh_collection(client, COLLECTION)
+    common.seed(client, COLLECTION, rows)
+
+    cases = [
+        ('fetchone per row (before)', lambda: per_row(client)),
+        ('iterate cursor', lambda: iterate(client, False)),
+        ('iter_batches', lambda: iterate_batches(client, False)),
+        ('iterate cursor, stream', lambda: iterate(client, True)),
+        ('iter_batches, stream', lambda: iterate_batches(client, True)),
+    ]
+    for label, fn in cases:
+        elapsed, count = common.timed(fn)
+        common.report(label, count, elapsed)
+
+    client.delete_collection(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
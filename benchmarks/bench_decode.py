@@ -0,0 +1,62 @@
+"""
+Compare the docs/sec of decoding large documents in the driver against
+decoding them on a process pool with BedquiltCursor.decode_with.
+
+Usage: python benchmarks/bench_decode.py [row-count] [processes]
+"""
+import sys
+import common
+from concurrent.futures import ProcessPoolExecutor
+
+
+COLLECTION = 'bench_decode'
+
+
+def seed_large(client, count):
+    # documents of around 10kB, with a list of 200 small objects each
+    client._query("""
+    select count(bq_insert(%s, jsonb_build_object(
+        'n', n,
+        'items', (select jsonb_agg(jsonb_build_object(
+                     'i', i, 'hash', md5((n * i)::text)))
+                  from generate_series(1, 200) as i))))
+    from generate_series(1, %s) as n;
+    """, (COLLECTION, count))
+
+
+def in_driver(client):
+    count = 0
+    for _ in client[COLLECTION].find(stream=True):
+        count += 1
+    return count
+
+
+def on_pool(client, executor, chunk_size):
+    count = 0
+    cursor = client[COLLECTION].find(stream=True, raw=True)
+    for _ in cursor.decode_with(executor, chunk_size=chunk_size):
+        count += 1
+    return count
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    client = common.get_client()
+    common.fresh_collection(client, COLLECTION)
+    seed_large(client, rows)
+
+    elapsed, count = common.timed(in_driver, client)
+    common.report('decode in driver', count, elapsed, 'docs')
+    with ProcessPoolExecutor(processes) as executor:
+        for chunk_size in [100, 500, 2000]:
+            elapsed, count = common.timed(
+                on_pool, client, executor, chunk_size)
+            common.report('decode_with {} processes, chunks of {}'.format(
+                processes, chunk_size), count, elapsed, 'docs')
+
+    client.delete_collection(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
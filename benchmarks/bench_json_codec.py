@@ -0,0 +1,63 @@
+"""
+Compare the encode and decode throughput of the json codecs a
+BedquiltClient can be configured with. Codecs whose libraries are not
+installed are skipped. This benchmark does not need a database.
+
+Usage: python benchmarks/bench_json_codec.py [iterations]
+"""
+import sys
+import json
+import common
+from pybedquilt.core import JSONCodec, _get_json_codec
+
+
+DOCUMENT = {
+    '_id': 'sarah@example.com',
+    'name': 'Sarah Jones',
+    'age': 27,
+    'city': 'Edinburgh',
+    'likes': ['icecream', 'code', 'tigers'],
+    'address': {'street': 'Mill Lane', 'number': 22, 'verified': True},
+    'scores': [0.5, 12.25, 99.0, 3.75] * 5,
+}
+
+
+def codecs():
+    yield 'json', _get_json_codec(None)
+    for name in ['simplejson', 'ujson', 'orjson']:
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        if name == 'orjson':
+            yield name, _get_json_codec('auto')
+        else:
+            yield name, JSONCodec(module.dumps, module.loads)
+
+
+def encode(codec, count):
+    dumps = codec.dumps
+    for _ in range(count):
+        dumps(DOCUMENT)
+    return count
+
+
+def decode(codec, text, count):
+    loads = codec.loads
+    for _ in range(count):
+        loads(text)
+    return count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    text = json.dumps(DOCUMENT)
+    for name, codec in codecs():
+        elapsed, _ = common.timed(encode, codec, count)
+        common.report('{} encode'.format(name), count, elapsed, 'docs')
+        elapsed, _ = common.timed(decode, codec, text, count)
+        common.report('{} decode'.format(name), count, elapsed, 'docs')
+
+
+if __name__ == '__main__':
+    main()
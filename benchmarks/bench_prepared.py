@@ -0,0 +1,50 @@
+"""
+Compare the latency of find_one_by_id, insert and count with and
+without prepared statements.
+
+Usage: python benchmarks/bench_prepared.py [iterations]
+"""
+import sys
+import common
+
+
+COLLECTION = 'bench_prepared'
+
+
+def find_one_by_id(coll, count):
+    for n in range(count):
+        coll.find_one_by_id('doc{}'.format(n % 1000))
+    return count
+
+
+def insert(coll, count):
+    for n in range(count):
+        coll.insert({'n': n})
+    return count
+
+
+def count(coll, count):
+    for n in range(count):
+        coll.count({'n': n})
+    return count
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    client = common.get_client()
+    coll = common.fresh_collection(client, COLLECTION)
+    coll.insert_many([{'_id': 'doc{}'.format(n), 'n': n}
+                      for n in range(1000)])
+
+    for prepare in [False, True]:
+        coll = common.get_client(prepare=prepare)[COLLECTION]
+        for fn in [find_one_by_id, insert, count]:
+            elapsed, _ = common.timed(fn, coll, iterations)
+            print('{:<30} prepare={:<5} {:>8.1f} us/op'.format(
+                fn.__name__, str(prepare), elapsed / iterations * 1e6))
+
+    client.delete_collection(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare the throughput of saving documents with a loop of save() calls
+against save_many(), and insert() against insert_many().
+
+Usage: python benchmarks/bench_save.py [document-count]
+"""
+import sys
+import common
+
+
+COLLECTION = 'bench_save'
+
+
+def loop(method, docs):
+    for doc in docs:
+        method(doc)
+    return len(docs)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    client = common.get_client()
+    docs = [{'_id': 'doc{}'.format(n), 'n': n, 'tags': ['a', 'b']}
+            for n in range(count)]
+
+    coll = common.fresh_collection(client, COLLECTION)
+    elapsed, _ = common.timed(loop, coll.insert, docs)
+    common.report('insert() loop', count, elapsed, 'docs')
+
+    coll = common.fresh_collection(client, COLLECTION)
+    elapsed, _ = common.timed(coll.insert_many, docs)
+    common.report('insert_many()', count, elapsed, 'docs')
+
+    # both save cases overwrite existing documents
+    elapsed, _ = common.timed(loop, coll.save, docs)
+    common.report('save() loop', count, elapsed, 'docs')
+
+    elapsed, _ = common.timed(coll.save_many, docs)
+    common.report('save_many()', count, elapsed, 'docs')
+
+    client.delete_collection(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Helpers shared by the pybedquilt benchmarks.
+
+The benchmarks need a PostgreSQL server with the bedquilt extension
+installed. Set BEDQUILT_BENCH_DSN to point at it, the default is
+"dbname=bedquilt_test", the same database used by the tests.
+"""
+import os
+import math
+import time
+import pybedquilt
+
+
+DSN = os.environ.get('BEDQUILT_BENCH_DSN', 'dbname=bedquilt_test')
+
+
+def get_client(**kwargs):
+    return pybedquilt.BedquiltClient(DSN, **kwargs)
+
+
+def fresh_collection(client, collection_name):
+    """
+    Get an empty collection, deleting any previous contents.
+    """
+    client.delete_collection(collection_name)
+    client.create_collection(collection_name)
+    return client[collection_name]
+
+
+def seed(client, collection_name, count):
+    """
+    Insert `count` small documents of the form {"n": <int>} into the
+    collection, generating them on the server.
+    """
+    result = client._query("""
+    select count(bq_insert(%s, jsonb_build_object('n', n)))
+    from generate_series(1, %s) as n;
+    """, (collection_name, count))
+    return result[0][0]
+
+
+def timed(fn, *args, **kwargs):
+    """
+    Call fn, returning a tuple of (elapsed seconds, result).
+    """
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return time.time() - start, result
+
+
+def report(label, count, elapsed, unit='rows'):
+    print('{:<40} {:>10} {} in {:>8.3f}s {:>14,.0f} {}/sec'.format(
+        label, count, unit, elapsed, count / elapsed, unit))
+
+
+# a high resolution clock, where available
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def percentile(sorted_values, fraction):
+    """
+    Get a percentile of a sorted list, by the nearest-rank method.
+    """
+    rank = int(math.ceil(fraction * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def latency_stats(latencies):
+    """
+    Summarise a list of per-operation latencies, in seconds.
+    Returns: dict of ops_per_sec and p50, p95 and p99 in milliseconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        'iterations': len(latencies),
+        'ops_per_sec': len(latencies) / sum(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
@@ -0,0 +1,246 @@
+"""
+An in-process stand-in for a bedquilt server, which answers every query
+instantly with canned rows. A BedquiltClient connected to one of these
+measures only its own work: checking arguments, encoding documents,
+creating cursors and decoding and unpacking rows.
+
+install() patches psycopg2, so that connecting to the dsn of a
+FakeServer opens a FakeConnection to it, and typecasters can be
+registered on fake connections and cursors.
+
+Example:
+  fakedb.install()
+  server = fakedb.FakeServer()
+  server.respond('bq_find_one_by_id', fakedb.jsonb_rows([{'_id': 'a'}]))
+  client = pybedquilt.BedquiltClient(server.dsn)
+"""
+import collections
+import itertools
+import json
+import re
+import psycopg2
+import psycopg2.extensions
+import psycopg2._json
+
+
+JSONB_OID = 3802
+
+PREPARE = re.compile(r'\s*prepare (\w+) as (.*)$', re.DOTALL)
+EXECUTE = re.compile(r'\s*execute (\w+)\(')
+TRANSACTION = re.compile(r'\s*(begin|commit|rollback);')
+
+# dsn -> FakeServer
+_SERVERS = {}
+_SERVER_NUMBERS = itertools.count()
+_ORIGINALS = {}
+
+ConnectionInfo = collections.namedtuple('ConnectionInfo',
+                                        'transaction_status')
+
+
+class Jsonb(str):
+    """
+    The json text of a jsonb value in a canned row. Decoded on fetch by
+    the cursor's jsonb typecaster, as psycopg2 decodes jsonb columns.
+    """
+
+
+def jsonb_rows(docs):
+    """
+    Canned rows of a single jsonb column, one per document.
+    """
+    return [(Jsonb(json.dumps(doc)),) for doc in docs]
+
+
+def install():
+    """
+    Patch psycopg2 so that connect() opens a FakeConnection when given
+    the dsn of a FakeServer, and register_type() registers typecasters on
+    fake connections and cursors. Anything else is passed through to
+    psycopg2. Safe to call more than once.
+    """
+    if _ORIGINALS:
+        return
+    _ORIGINALS['connect'] = psycopg2.connect
+    _ORIGINALS['register_type'] = psycopg2.extensions.register_type
+    psycopg2.connect = _connect
+    psycopg2.extensions.register_type = _register_type
+    # psycopg2's jsonb helpers use their own reference to register_type
+    psycopg2._json.register_type = _register_type
+
+
+def _connect(dsn=None, **kwargs):
+    server = _SERVERS.get(dsn)
+    if server is None:
+        return _ORIGINALS['connect'](dsn, **kwargs)
+    return FakeConnection(server)
+
+
+def _register_type(type_caster, scope=None):
+    if isinstance(scope, (FakeConnection, FakeCursor)):
+        for oid in type_caster.values:
+            scope._typecasters[oid] = type_caster
+    elif scope is None:
+        _ORIGINALS['register_type'](type_caster)
+    else:
+        _ORIGINALS['register_type'](type_caster, scope)
+
+
+class FakeServer(object):
+
+    def __init__(self):
+        self.dsn = 'dbname=fakedb{}'.format(next(_SERVER_NUMBERS))
+        # number of statements executed, including prepares
+        self.executed = 0
+        self._responses = []
+        self.respond('pg_extension', [('bedquilt',)])
+        self.respond('bq_util_assert_minimum_version', [(None,)])
+        _SERVERS[self.dsn] = self
+
+    def respond(self, pattern, rows):
+        """
+        Answer queries containing the string pattern with rows, either
+        a list of row tuples or a function(query, params) returning one.
+        Later responses take precedence, and queries which match none
+        are answered with a single null.
+        """
+        self._responses.insert(0, (pattern, rows))
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def _answer(self, query, params):
+        self.executed += 1
+        for pattern, rows in self._responses:
+            if pattern in query:
+                return rows(query, params) if callable(rows) else rows
+        return [(None,)]
+
+
+class FakeConnection(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.dsn = server.dsn
+        self.autocommit = False
+        self.closed = 0
+        self.notices = []
+        self.notifies = []
+        self._statements = {}
+        self._typecasters = {}
+        self._transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self, name=None, **kwargs):
+        if self.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+        return FakeCursor(self, name)
+
+    def get_transaction_status(self):
+        return self._transaction_status
+
+    @property
+    def info(self):
+        # psycopg2's pools check the transaction status through info
+        return ConnectionInfo(self._transaction_status)
+
+    def commit(self):
+        self._transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        self._transaction_status = (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def poll(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+    def _answer(self, query, params):
+        query = str(query)
+        if TRANSACTION.match(query):
+            self.server.executed += 1
+            self._transaction_status = (
+                psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+                if query.strip().startswith('begin')
+                else psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+            return []
+        if not self.autocommit:
+            # as psycopg2 begins a transaction before the first statement
+            self._transaction_status = (
+                psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        prepare = PREPARE.match(query)
+        if prepare:
+            self.server.executed += 1
+            self._statements[prepare.group(1)] = prepare.group(2)
+            return []
+        execute = EXECUTE.match(query)
+        if execute:
+            query = self._statements[execute.group(1)]
+        return self.server._answer(query, params)
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.closed = False
+        self.query = None
+        self.itersize = 2000
+        self.arraysize = 1
+        self.rowcount = -1
+        self._typecasters = {}
+        self._rows = []
+        self._position = 0
+
+    def execute(self, query, params=None):
+        if self.closed:
+            raise psycopg2.InterfaceError('cursor already closed')
+        self.query = query
+        self._rows = self.connection._answer(query, params)
+        self._position = 0
+        self.rowcount = len(self._rows)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection._answer(sql, None)
+        while file.read(size):
+            pass
+
+    def _cast(self, row):
+        if not any(isinstance(value, Jsonb) for value in row):
+            return row
+        type_caster = (self._typecasters.get(JSONB_OID)
+                       or self.connection._typecasters.get(JSONB_OID)
+                       or psycopg2.extensions.string_types[JSONB_OID])
+        # psycopg2's own typecasters expect one of its cursors, or None
+        return tuple(type_caster(value, None) if isinstance(value, Jsonb)
+                     else value for value in row)
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._cast(self._rows[self._position - 1])
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return [self._cast(row) for row in rows]
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return [self._cast(row) for row in rows]
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def close(self):
+        self.closed = True
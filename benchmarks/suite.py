@@ -0,0 +1,261 @@
+"""
+The pybedquilt benchmark suite. Measures the throughput and latency
+percentiles of the main collection operations, writes the results as
+json, and compares them against a saved baseline, exiting with status 1
+if any operation has regressed by more than the tolerance.
+
+Usage:
+  python benchmarks/suite.py [--iterations N] [--seed-count N]
+                             [--only NAME [NAME ...]] [--output FILE]
+                             [--baseline FILE] [--tolerance FRACTION]
+                             [--save-baseline FILE]
+
+  make bench             run, and compare against benchmarks/baseline.json,
+                         failing if there is no baseline
+  make bench-baseline    run, and save the results as the baseline
+
+Baselines depend on the machine and server they are measured on, so none
+is committed: run `make bench-baseline` once before `make bench`.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import common
+
+
+COLLECTION = 'bench_suite'
+SEED_COUNT = 10000
+DEFAULT_OUTPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'results', 'latest.json')
+
+# name -> function(client, iterations), returning a list of latencies
+CASES = []
+
+
+def case(fn):
+    CASES.append((fn.__name__, fn))
+    return fn
+
+
+def measure(fn, args):
+    """
+    Call fn once with each item of args, timing each call.
+    Returns: list of latencies in seconds.
+    """
+    latencies = []
+    for arg in args:
+        start = common.clock()
+        fn(arg)
+        latencies.append(common.clock() - start)
+    return latencies
+
+
+def seeded_collection(client, count=None):
+    if count is None:
+        count = SEED_COUNT
+    coll = common.fresh_collection(client, COLLECTION)
+    client._query("""
+    select count(bq_insert(%s, jsonb_build_object(
+        '_id', 'doc' || n,
+        'n', n,
+        'color', case when n %% 2 = 0 then 'red' else 'blue' end,
+        'tags', jsonb_build_array('a', 'b', 'c'))))
+    from generate_series(0, %s - 1) as n;
+    """, (COLLECTION, count))
+    return coll
+
+
+def docs(count, prefix='new'):
+    return [{'_id': '{}{}'.format(prefix, n), 'n': n, 'color': 'green',
+             'tags': ['a', 'b', 'c']} for n in range(count)]
+
+
+@case
+def insert(client, iterations):
+    coll = common.fresh_collection(client, COLLECTION)
+    return measure(coll.insert, docs(iterations))
+
+
+@case
+def save(client, iterations):
+    coll = seeded_collection(client)
+    return measure(coll.save, [
+        {'_id': 'doc{}'.format(n % SEED_COUNT), 'n': n, 'color': 'green'}
+        for n in range(iterations)])
+
+
+@case
+def find_small(client, iterations):
+    coll = seeded_collection(client)
+    return measure(lambda n: list(coll.find({'color': 'red'}, skip=n % 100,
+                                            limit=10)),
+                   range(iterations))
+
+
+@case
+def find_large(client, iterations):
+    coll = seeded_collection(client)
+    return measure(lambda _: list(coll.find()),
+                   range(max(iterations // 100, 5)))
+
+
+@case
+def find_one_by_id(client, iterations):
+    coll = seeded_collection(client)
+    return measure(coll.find_one_by_id,
+                   ['doc{}'.format(n % SEED_COUNT) for n in range(iterations)])
+
+
+@case
+def count(client, iterations):
+    coll = seeded_collection(client)
+    return measure(lambda _: coll.count({'color': 'red'}),
+                   range(max(iterations // 10, 5)))
+
+
+@case
+def distinct(client, iterations):
+    coll = seeded_collection(client)
+    return measure(lambda _: list(coll.distinct('color')),
+                   range(max(iterations // 10, 5)))
+
+
+@case
+def remove_many_by_ids(client, iterations):
+    coll = seeded_collection(client, max(iterations * 10, SEED_COUNT))
+    return measure(coll.remove_many_by_ids, [
+        ['doc{}'.format(n * 10 + x) for x in range(10)]
+        for n in range(iterations)])
+
+
+@case
+def insert_with_constraints(client, iterations):
+    coll = common.fresh_collection(client, COLLECTION)
+    coll.add_constraints({
+        'n': {'$required': 1, '$notnull': 1, '$type': 'number'},
+        'color': {'$required': 1, '$type': 'string'},
+        'tags': {'$type': 'array'},
+    })
+    return measure(coll.insert, docs(iterations))
+
+
+def run(names, iterations):
+    client = common.get_client()
+    results = {}
+    for name, fn in CASES:
+        if names and name not in names:
+            continue
+        stats = common.latency_stats(fn(client, iterations))
+        results[name] = stats
+        print('{:<26} {:>10,.0f} ops/sec  p50 {:>8.3f}ms  '
+              'p95 {:>8.3f}ms  p99 {:>8.3f}ms'.format(
+                  name, stats['ops_per_sec'], stats['p50_ms'],
+                  stats['p95_ms'], stats['p99_ms']))
+    client.delete_collection(COLLECTION)
+    client.close()
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dsn': common.DSN,
+            'iterations': iterations,
+            'seed_count': SEED_COUNT,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline. An operation has regressed if its
+    ops/sec has dropped, or its p95 latency has risen, by more than
+    tolerance, as a fraction of the baseline.
+    Returns: list of descriptions of regressions.
+    """
+    regressions = []
+    print('\ncompared to baseline of {}:'.format(baseline['meta']['time']))
+    for name, stats in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:<26} (not in baseline)'.format(name))
+            continue
+        ops_change = stats['ops_per_sec'] / base['ops_per_sec'] - 1
+        p95_change = stats['p95_ms'] / base['p95_ms'] - 1
+        failed = []
+        if ops_change < -tolerance:
+            failed.append('ops/sec {:+.1%}'.format(ops_change))
+        if p95_change > tolerance:
+            failed.append('p95 {:+.1%}'.format(p95_change))
+        print('{:<26} ops/sec {:>+7.1%}  p95 {:>+7.1%}  {}'.format(
+            name, ops_change, p95_change, 'REGRESSED' if failed else 'ok'))
+        if failed:
+            regressions.append('{}: {}'.format(name, ', '.join(failed)))
+    return regressions
+
+
+def write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def main():
+    global SEED_COUNT
+    parser = argparse.ArgumentParser(
+        description='Run the pybedquilt benchmark suite.')
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='operations per benchmark (default 1000)')
+    parser.add_argument('--seed-count', type=int, default=SEED_COUNT,
+                        help='documents in the collections read from '
+                             '(default {})'.format(SEED_COUNT))
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        choices=[name for name, _ in CASES],
+                        help='run only these benchmarks')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='file to write the json results to')
+    parser.add_argument('--baseline',
+                        help='json results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which an operation may be slower '
+                             'than the baseline (default 0.2)')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='also write the results to FILE, as the new '
+                             'baseline')
+    args = parser.parse_args()
+    SEED_COUNT = args.seed_count
+
+    results = run(args.only, args.iterations)
+    write_json(args.output, results)
+    print('\nresults written to {}'.format(args.output))
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+        print('baseline written to {}'.format(args.save_baseline))
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            # without a baseline nothing would be gated, so fail loudly
+            sys.stderr.write(
+                'ERROR: no baseline at {}, so regressions cannot be checked.'
+                ' Run `make bench-baseline` to save one.\n'.format(
+                    args.baseline))
+            return 1
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('\n{} regression(s) beyond {:.0%}:'.format(
+                len(regressions), args.tolerance))
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,53 @@
-from pybedquilt.core import \
-    BedquiltClient, \
-    BedquiltCollection, \
-    BedquiltCursor
+import sys
+
+
+# name -> module which defines it, imported on first use so that
+# `import pybedquilt` does not load the database driver
+_EXPORTS = {
+    'BedquiltClient': 'pybedquilt.core',
+    'BedquiltCollection': 'pybedquilt.core',
+    'BedquiltCursor': 'pybedquilt.core',
+    'BedquiltPipeline': 'pybedquilt.core',
+    'DocumentCache': 'pybedquilt.core',
+    'JSONCodec': 'pybedquilt.core',
+    'OperationEvent': 'pybedquilt.core',
+    'OperationListener': 'pybedquilt.core',
+    'PipelineCollection': 'pybedquilt.core',
+    'PipelineResult': 'pybedquilt.core',
+    'SlowOperationLog': 'pybedquilt.core',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+if sys.version_info >= (3, 7):
+    def _import(module_name):
+        __import__(module_name)
+        return sys.modules[module_name]
+
+    def __getattr__(name):
+        if name in _EXPORTS:
+            value = getattr(_import(_EXPORTS[name]), name)
+        elif name in ('core', 'aio'):
+            value = _import('pybedquilt.' + name)
+        else:
+            raise AttributeError(
+                "module 'pybedquilt' has no attribute '{}'".format(name))
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(list(globals()) + __all__)
+else:
+    from pybedquilt.core import \
+        BedquiltClient, \
+        BedquiltCollection, \
+        BedquiltCursor, \
+        BedquiltPipeline, \
+        DocumentCache, \
+        JSONCodec, \
+        OperationEvent, \
+        OperationListener, \
+        PipelineCollection, \
+        PipelineResult, \
+        SlowOperationLog
@@ -0,0 +1,738 @@
+"""
+Asyncio versions of BedquiltClient, BedquiltCollection and BedquiltCursor,
+built on the aiopg driver. Requires python >= 3.5 and aiopg:
+  $ pip install pybedquilt[async]
+Example:
+  - client = AsyncBedquiltClient("dbname=test")
+  - doc = await client['people'].find_one_by_id('sarah@example.com')
+  - async with client['people'].find({'city': 'Edinburgh'}) as cursor:
+        async for doc in cursor: ...
+"""
+import asyncio
+import warnings
+import aiopg
+import psycopg2.extensions
+
+from pybedquilt.core import \
+    MIN_SERVER_VERSION, \
+    RAW_JSONB, \
+    _BOOTSTRAPPED, \
+    _batches, \
+    _cursor_name, \
+    _get_json_codec, \
+    _many_query, \
+    _project, \
+    _register_json_codec, \
+    _unpack_rows
+
+
+async def _query(cursor, query_string, params=None, raw=False):
+    if raw:
+        psycopg2.extensions.register_type(RAW_JSONB, cursor.raw)
+    if params is None:
+        params = tuple()
+    await cursor.execute(query_string, params)
+    result = await cursor.fetchall()
+    return result
+
+
+async def _release_cursor(pool, connection, cursor, end=None):
+    """
+    End the transaction of a streaming cursor with `end`, either 'commit'
+    or 'rollback', if it has one, and return its connection to the pool.
+    """
+    try:
+        if end is not None and cursor is not None:
+            await cursor.execute("{};".format(end))
+    finally:
+        if cursor is not None:
+            cursor.close()
+        await pool.release(connection)
+
+
+class AsyncBedquiltCursor(object):
+    def __init__(self, collection, query, params, stream=None,
+                 batch_size=None, raw=False):
+        """
+        Create an AsyncBedquiltCursor. The query is executed on first use.
+        A streaming cursor holds a pooled connection, inside a transaction,
+        until it is exhausted or closed, so use it with `async with` if
+        iteration may stop early.
+        Args:
+          - collection: instance of AsyncBedquiltCollection.
+          - query: sql string to execute.
+          - params: tuple of parameters for the query.
+          - stream: (optional) boolean, whether to fetch rows from a
+            server-side cursor in batches, rather than loading the entire
+            result set into memory. Defaults to the `stream` setting
+            of the client.
+          - batch_size: (optional) integer number of rows to fetch and
+            decode at a time. Defaults to the `itersize` of the client.
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+        """
+        self.collection = collection
+        client = collection.client
+        if stream is None:
+            stream = client.stream
+        self.stream = stream
+        self.raw = raw
+        self.batch_size = batch_size or client.itersize
+        self.closed = False
+        self._query_string = query
+        self._params = params
+        self._connection = None
+        self._cursor = None
+        self._name = None
+        self._loop = None
+        self._rows = None
+        self._row_position = 0
+        self._buffer = []
+        self._position = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._position >= len(self._buffer):
+            self._buffer = await self._fetch_batch()
+            self._position = 0
+            if not self._buffer:
+                raise StopAsyncIteration
+        doc = self._buffer[self._position]
+        self._position += 1
+        return doc
+
+    async def next_batch(self):
+        """
+        Get the next batch of documents from the cursor.
+        Returns: list of up to `batch_size` documents, or an empty
+        list when the cursor is exhausted.
+        """
+        if self._position < len(self._buffer):
+            batch = self._buffer[self._position:]
+        else:
+            batch = await self._fetch_batch()
+        self._buffer = []
+        self._position = 0
+        return batch
+
+    async def to_list(self):
+        """
+        Get all remaining documents from the cursor.
+        Returns: list of documents.
+        """
+        result = []
+        batch = await self.next_batch()
+        while batch:
+            result.extend(batch)
+            batch = await self.next_batch()
+        return result
+
+    async def close(self):
+        """
+        Close the cursor, releasing any server-side resources, and
+        return the connection to the client's pool.
+        """
+        await self._close('commit')
+
+    async def _close(self, end):
+        if self.closed:
+            return
+        self.closed = True
+        self._rows = None
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        await _release_cursor(
+            self.collection.client.pool, connection, self._cursor,
+            end if self._name is not None else None)
+
+    def __del__(self):
+        if getattr(self, '_connection', None) is None:
+            return
+        warnings.warn(
+            "AsyncBedquiltCursor was not closed, use it with `async with` "
+            "to return its connection to the pool", ResourceWarning)
+        connection, self._connection = self._connection, None
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(
+                self._loop.create_task, _release_cursor(
+                    self.collection.client.pool, connection, self._cursor,
+                    'rollback' if self._name is not None else None))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _start(self):
+        pool = await self.collection.client._get_pool()
+        self._loop = asyncio.get_event_loop()
+        self._connection = await pool.acquire()
+        self._cursor = await self._connection.cursor()
+        if self.raw:
+            psycopg2.extensions.register_type(
+                RAW_JSONB, self._cursor.raw)
+        if self.stream:
+            # async connections cannot use named cursors, so declare
+            # one by hand inside a transaction
+            self._name = _cursor_name()
+            await self._cursor.execute("begin;")
+            await self._cursor.execute(
+                "declare {} no scroll cursor for {}".format(
+                    self._name, self._query_string),
+                self._params)
+        else:
+            self._rows = await _query(
+                self._cursor, self._query_string, self._params)
+            # the whole result is fetched, so the connection is free
+            connection, self._connection = self._connection, None
+            await _release_cursor(pool, connection, self._cursor)
+
+    async def _fetch_batch(self):
+        if self.closed:
+            return []
+        try:
+            if self._connection is None:
+                await self._start()
+            if self.stream:
+                await self._cursor.execute(
+                    "fetch forward {} from {};".format(
+                        int(self.batch_size), self._name))
+                rows = await self._cursor.fetchall()
+            else:
+                rows = self._rows[self._row_position:
+                                  self._row_position + self.batch_size]
+                self._row_position += len(rows)
+        except BaseException:
+            # including cancellation, which would otherwise leave the
+            # connection checked out inside an open transaction
+            await self._close('rollback')
+            raise
+        if len(rows) < self.batch_size:
+            await self.close()
+        return _unpack_rows(rows)
+
+
+class AsyncBedquiltClient(object):
+
+    def __init__(self, dsn=None, pool_size=10, stream=True, itersize=2000,
+                 json_codec=None, **kwargs):
+        """
+        Create an AsyncBedquiltClient object. The connection pool is
+        created on first use, or by awaiting `connect()`.
+        Args:
+          - dsn: A psycopg2-style dsn string
+          - pool_size: (optional) integer maximum number of connections
+            to keep in the pool (default 10).
+          - stream: (optional) boolean, whether cursors returned by find,
+            find_many_by_ids and distinct should stream results from a
+            server-side cursor by default (default True).
+          - itersize: (optional) integer number of rows to fetch and
+            decode at a time when iterating a cursor (default 2000).
+          - json_codec: (optional) the json implementation used to encode
+            and decode documents, as for BedquiltClient.
+        Example:
+          - AsyncBedquiltClient("dbname=test")
+        """
+        if dsn is None and not kwargs:
+            raise Exception("Cannot create connection")
+        self.dsn = dsn
+        self.pool = None
+        self.pool_size = pool_size
+        self.stream = stream
+        self.itersize = itersize
+        self.json_codec = _get_json_codec(json_codec)
+        self._connect_kwargs = kwargs
+        # created on first use, as before python 3.10 a lock is bound to
+        # the event loop current when it is created
+        self._connect_lock = None
+
+    async def connect(self):
+        """
+        Create the connection pool and bootstrap the client.
+        Returns: the client.
+        """
+        await self._get_pool()
+        return self
+
+    async def _get_pool(self):
+        if self.pool is not None:
+            return self.pool
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.pool is None:
+                pool = await aiopg.create_pool(
+                    self.dsn, minsize=1, maxsize=self.pool_size,
+                    on_connect=self._on_connect, **self._connect_kwargs)
+                try:
+                    await self._bootstrap(pool)
+                except Exception:
+                    pool.close()
+                    await pool.wait_closed()
+                    raise
+                self.pool = pool
+        return self.pool
+
+    async def _on_connect(self, connection):
+        _register_json_codec(connection.raw, self.json_codec)
+
+    async def _bootstrap(self, pool):
+        """
+        Do whatever needs to be done to bootstrap/initialize the client.
+        This is done once per server, identified by the dsn of the
+        connection.
+        """
+        async with pool.acquire() as connection:
+            if connection.dsn in _BOOTSTRAPPED:
+                return
+            async with connection.cursor() as cursor:
+                result = await _query(cursor, """
+                select * from pg_catalog.pg_extension
+                where extname = 'bedquilt';
+                """)
+
+                assert (result is not None and len(result) > 0), \
+                    "Bedquilt extension not found on database server"
+
+                _ = await _query(cursor, """
+                select bq_util_assert_minimum_version('{}')
+                """.format(MIN_SERVER_VERSION))
+
+            _BOOTSTRAPPED.add(connection.dsn)
+
+    async def _query(self, query_string, params=None, raw=False):
+        pool = await self._get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                return await _query(cursor, query_string, params, raw)
+
+    async def close(self):
+        """
+        Close all pooled connections to the database server.
+        """
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.close()
+            await pool.wait_closed()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def create_collection(self, collection_name):
+        """
+        Create a collection.
+        Args:
+          - collection_name: string name of collection.
+        Returns:
+          - Boolean representing whether the collection was created or not.
+        """
+        result = await self._query("""
+        select bq_create_collection(%s)
+        """, (collection_name,))
+        return result[0][0]
+
+    async def delete_collection(self, collection_name):
+        """
+        Delete a collection.
+        Args:
+          - collection_name: string name of collection.
+        Returns:
+          - Boolean representing whether the collection was deleted or not.
+        """
+        result = await self._query("""
+        select bq_delete_collection(%s)
+        """, (collection_name,))
+        return result[0][0]
+
+    async def list_collections(self):
+        """
+        Get a list collections on the database server.
+        Args: None
+        Returns: List of string names of collections.
+        """
+        result = await self._query("""
+        select bq_list_collections();
+        """)
+
+        return list(map(lambda r: r[0], result))
+
+    async def collection_exists(self, collection_name):
+        """
+        Check if a collection exists.
+        Args:
+          - collection_name: string name of collection.
+        Returns: Boolean
+        """
+        result = await self._query("""
+        select bq_collection_exists(%s)
+        """, (collection_name,))
+        return result[0][0]
+
+    def collection(self, collection_name):
+        """
+        Get an AsyncBedquiltCollection object.
+        Args:
+          - collection_name: string name of collection.
+        Returns: Instance of AsyncBedquiltCollection.
+        """
+        return AsyncBedquiltCollection(self, collection_name)
+
+    def __getitem__(self, collection_name):
+        return self.collection(collection_name)
+
+
+class AsyncBedquiltCollection(object):
+
+    def __init__(self, client, collection_name):
+        """
+        Create an AsyncBedquiltCollection object.
+        Args:
+          - client: instance of AsyncBedquiltClient.
+          - collection_name: string name of collection.
+        """
+        self.client = client
+        self.collection_name = collection_name
+        self._dumps = client.json_codec.dumps
+
+    async def _query(self, query_string, params, raw=False):
+        return await self.client._query(query_string, params, raw)
+
+    # Read
+    def find(self, query_doc=None, skip=0, limit=None, sort=None,
+             stream=None, raw=False, projection=None, batch_size=None):
+        """
+        Find documents in collection.
+        Args:
+          - query_doc: dict representing query.
+          - skip: (optional) integer number of documents to skip (default 0).
+          - limit: (optional) integer number of documents to limit result set to (default None).
+          - sort: (optional) list of dict, representing sort specification.
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
+          - batch_size: (optional) integer number of rows to fetch and
+            decode at a time. Defaults to the `itersize` of the client.
+        Returns: AsyncBedquiltCursor
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+
+        if sort is not None:
+            assert type(sort) is list
+            sort = self._dumps(sort)
+
+        query_string, params = _project("""
+        bq_find(%s, %s::jsonb, %s, %s, %s::jsonb)
+        """, projection)
+        return AsyncBedquiltCursor(self, query_string, params + (
+            self.collection_name, self._dumps(query_doc),
+            skip, limit, sort), stream=stream, batch_size=batch_size,
+            raw=raw)
+
+    async def find_one(self, query_doc=None, skip=0, sort=None, raw=False,
+                       projection=None):
+        """
+        Find a single document in collection.
+        Args:
+          - query_doc: dict representing query.
+          - skip: (optional) integer number of documents to skip (default 0).
+          - sort: (optional) list of dict, representing sort specification.
+          - raw: (optional) boolean, return the document as an undecoded
+            json string (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
+        Returns: A dictionary if found, or None.
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+
+        if sort is not None:
+            assert type(sort) is list
+            sort = self._dumps(sort)
+
+        query_string, params = _project("""
+        bq_find_one(%s, %s::jsonb, %s, %s::jsonb)
+        """, projection)
+        result = await self._query(query_string, params + (
+            self.collection_name, self._dumps(query_doc),
+            skip, sort), raw)
+
+        if len(result) == 1:
+            return _unpack_rows(result)[0]
+        else:
+            return None
+
+    async def find_one_by_id(self, doc_id, raw=False, projection=None):
+        """
+        Find a single document in collection.
+        Args:
+          - doc_id: string to match against '_id' fields of collection.
+          - raw: (optional) boolean, return the document as an undecoded
+            json string (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
+        Returns: A dictionary if found, or None.
+        """
+        assert isinstance(doc_id, str)
+
+        query_string, params = _project("""
+        bq_find_one_by_id(%s, %s)
+        """, projection)
+        result = await self._query(
+            query_string, params + (self.collection_name, doc_id), raw)
+
+        if len(result) == 1:
+            return _unpack_rows(result)[0]
+        else:
+            return None
+
+    def find_many_by_ids(self, doc_ids, stream=None, raw=False):
+        """
+        Find many documents whose _ids are in the supplied list.
+        Args:
+          - doc_ids: list of strings to match against '_id' fields.
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+        Returns: AsyncBedquiltCursor
+        """
+        assert type(doc_ids) == list
+
+        return AsyncBedquiltCursor(self, """
+        select bq_find_many_by_ids(%s, %s::jsonb)
+        """, (self.collection_name, self._dumps(doc_ids)),
+            stream=stream, raw=raw)
+
+    async def count(self, query_doc=None):
+        """
+        Get a count of documents in this collection, with an optional
+        query document to match.
+        Args:
+          - query_doc: dict representing query. (optional)
+        Returns: Integer representing count of
+        documents in collection matching query
+        """
+        if query_doc is None:
+            query_doc = {}
+
+        assert type(query_doc) is dict
+
+        result = await self._query("""
+        select bq_count(%s, %s);
+        """, (self.collection_name, self._dumps(query_doc)))
+
+        return result[0][0]
+
+    def distinct(self, key_path, stream=None):
+        """
+        Get a sequence of the distinct values in this collection,
+        at the specified key-path.
+        Args:
+          - key_path: string specifying the key to look up
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
+        Returns: AsyncBedquiltCursor
+        """
+        assert isinstance(key_path, str)
+
+        return AsyncBedquiltCursor(self, """
+        select bq_distinct(%s, %s)
+        """, (self.collection_name, key_path), stream=stream)
+
+    # Create
+    async def insert(self, doc):
+        """
+        Insert a dictionary into collection.
+        Args:
+          - doc: dict representing document to insert.
+        Returns: string _id of saved document.
+        """
+        assert type(doc) is dict
+        result = await self._query("""
+        select bq_insert(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(doc)))
+        return result[0][0]
+
+    async def insert_many(self, docs, batch_size=1000):
+        """
+        Insert many dictionaries into collection, in batches, within a
+        single transaction.
+        Args:
+          - docs: list of dicts representing documents to insert.
+          - batch_size: (optional) integer number of documents to send
+            per statement (default 1000).
+        Returns: list of string _ids of saved documents, in the same
+        order as docs.
+        """
+        assert type(docs) is list
+        for doc in docs:
+            assert type(doc) is dict
+        return await self._many("bq_insert", docs, batch_size)
+
+    async def _many(self, function_name, docs, batch_size):
+        if not docs:
+            return []
+        batches = _batches(docs, batch_size)
+        query_string = _many_query(function_name)
+        if len(batches) == 1:
+            return _unpack_rows(await self._query(
+                query_string, (self.collection_name, self._dumps(docs))))
+
+        ids = []
+        pool = await self.client._get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute("begin;")
+                try:
+                    for batch in batches:
+                        ids.extend(_unpack_rows(await _query(
+                            cursor, query_string,
+                            (self.collection_name, self._dumps(batch)))))
+                except Exception:
+                    await cursor.execute("rollback;")
+                    raise
+                await cursor.execute("commit;")
+        return ids
+
+    # Update
+    async def save(self, doc):
+        """
+        Save a dict to collection. If the doc has an '_id' field and there is a
+        document in the collection with that _id, then that document will be
+        over-written by the supplied document. Otherwise, this behaves like insert.
+        Args:
+          - doc: python dict representing doc to save.
+        Returns: string _id field of saved document.
+        """
+        assert type(doc) is dict
+        result = await self._query("""
+        select bq_save(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(doc)))
+        return result[0][0]
+
+    async def save_many(self, docs, batch_size=1000):
+        """
+        Save many dicts to collection, with the same semantics as save,
+        in batches, within a single transaction.
+        Args:
+          - docs: list of dicts representing documents to save.
+          - batch_size: (optional) integer number of documents to send
+            per statement (default 1000).
+        Returns: list of string _id fields of saved documents, in the
+        same order as docs.
+        """
+        assert type(docs) is list
+        for doc in docs:
+            assert type(doc) is dict
+        return await self._many("bq_save", docs, batch_size)
+
+    # Delete
+    async def remove(self, query_doc):
+        """
+        Remove documents from the collection.
+        Args:
+          - query_doc: dictionary representing the query to match documents to remove.
+        Returns: integer number of documents removed.
+        """
+        assert type(query_doc) is dict
+        result = await self._query("""
+        select bq_remove(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(query_doc)))
+        return result[0][0]
+
+    async def remove_one(self, query_doc):
+        """
+        Remove a single document from the collection.
+        The first document to match the query doc will be removed.
+        Args:
+          - query_doc: dictionary representing the query to match documents to remove.
+        Returns: integer number of documents removed.
+        """
+        assert type(query_doc) is dict
+        result = await self._query("""
+        select bq_remove_one(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(query_doc)))
+        return result[0][0]
+
+    async def remove_one_by_id(self, doc_id):
+        """
+        Remove a single document from the collection.
+        Args:
+          - doc_id: string _id of the document to remove.
+        Returns: integer number of documents removed.
+        """
+        assert isinstance(doc_id, str)
+        result = await self._query("""
+        select bq_remove_one_by_id(%s, %s);
+        """, (self.collection_name, doc_id))
+        return result[0][0]
+
+    async def remove_many_by_ids(self, doc_ids):
+        """
+        Remove many documents from the collection, by their `_id` fields
+        Args:
+          - doc_ids: list of strings to match against '_id' fields.
+        Returns: integer number of documents removed.
+        """
+        assert type(doc_ids) == list
+        result = await self._query("""
+        select bq_remove_many_by_ids(%s, %s);
+        """, (self.collection_name, self._dumps(doc_ids)))
+        return result[0][0]
+
+    async def add_constraints(self, constraint_spec):
+        """
+        Add constraints to this collection.
+        Args:
+          - constraint_spec: dict describing constraints to add
+        Returns: boolean, indicating whether any of the constraint
+        rules were applied.
+        """
+        assert type(constraint_spec) is dict
+        result = await self._query("""
+        select bq_add_constraints(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(constraint_spec)))
+        return result[0][0]
+
+    async def list_constraints(self):
+        """
+        List all constraints on this collection.
+        Returns: list of strings.
+        """
+        result = await self._query("""
+        select bq_list_constraints(%s);
+        """, (self.collection_name,))
+        return list(map(lambda r: r[0], result))
+
+    async def remove_constraints(self, constraint_spec):
+        """
+        Remove constraints to this collection.
+        Args:
+          - constraint_spec: dict describing constraints to be removed
+        Returns: boolean, indicating whether any of the constraint
+        rules were removed.
+        """
+        assert type(constraint_spec) is dict
+        result = await self._query("""
+        select bq_remove_constraints(%s, %s::jsonb);
+        """, (self.collection_name, self._dumps(constraint_spec)))
+        return result[0][0]
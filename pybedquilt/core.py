@@ -1,12 +1,54 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 import json
 import six
+import uuid
+import contextlib
+import collections
+import hashlib
+import itertools
+import re
+import threading
+import select
+import logging
+import time
+import copy
+import base64
+import weakref
+import psycopg2.sql
+from six.moves import queue
 
 
 MIN_SERVER_VERSION = '2.0.0'
+JSONB_OID = 3802
+INVALID_SQL_STATEMENT_NAME = '26000'
+DUPLICATE_PREPARED_STATEMENT = '42P05'
+INVALIDATION_CHANNEL = 'pybedquilt_invalidate'
+# documents a statement may change before the invalidation trigger stops
+# notifying each of them, and invalidates the whole collection instead
+MAX_ROW_INVALIDATIONS = 10
+# statements a client keeps prepared on each connection, the least
+# recently used are deallocated beyond this
+MAX_PREPARED_STATEMENTS = 256
 
+logger = logging.getLogger(__name__)
 
-def _query(cursor, query_string, params=None):
+# jsonb typecaster which leaves values as undecoded json text
+RAW_JSONB = psycopg2.extensions.new_type(
+    (JSONB_OID,), 'BQ_RAW_JSONB', lambda value, cursor: value)
+
+# dsns of the servers which clients in this process have bootstrapped
+_BOOTSTRAPPED = set()
+
+# a clock which is not affected by changes to the system time
+_now = getattr(time, 'monotonic', time.time)
+
+
+def _query(cursor, query_string, params=None, raw=False):
+    if raw:
+        psycopg2.extensions.register_type(RAW_JSONB, cursor)
     if params is None:
         params = tuple()
     cursor.execute(query_string, params)
@@ -14,76 +56,1207 @@ def _query(cursor, query_string, params=None):
     return result
 
 
+def _prepared_statement(query_string):
+    """
+    Get the name and server-side form of a statement to PREPARE for
+    query_string, with its %s placeholders numbered as $1, $2, ... and
+    its escaped %% signs unescaped, as psycopg2 would have done.
+    Returns: tuple of (name, statement)
+    """
+    statement = query_string.strip().rstrip(';')
+    counter = itertools.count(1)
+    statement = re.sub(
+        r'%%|%s',
+        lambda match: ('%' if match.group(0) == '%%'
+                       else '${}'.format(next(counter))),
+        statement)
+    name = 'bq_{}'.format(
+        hashlib.md5(statement.encode('utf-8')).hexdigest()[:16])
+    return name, statement
+
+
+def _acquire(semaphore, timeout):
+    """
+    Acquire semaphore, waiting for up to timeout seconds, or for as long
+    as it takes if timeout is None.
+    Returns: boolean, whether it was acquired.
+    """
+    if timeout is None:
+        return semaphore.acquire()
+    if not six.PY2:
+        return semaphore.acquire(timeout=timeout)
+    # python 2 semaphores cannot wait with a timeout
+    deadline = _now() + timeout
+    while not semaphore.acquire(False):
+        if _now() >= deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def _end_transaction(connection, commit=True):
+    """
+    End the transaction of a connection which was taken out of autocommit
+    mode, and return it to autocommit mode, or close it if that fails.
+    """
+    if connection.closed:
+        return
+    try:
+        if commit:
+            connection.commit()
+        else:
+            connection.rollback()
+    finally:
+        if connection.closed:
+            pass
+        elif (connection.get_transaction_status()
+              == psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            connection.autocommit = True
+        else:
+            connection.close()
+
+
+@contextlib.contextmanager
+def _transaction(cursor):
+    """
+    Run the statements issued on cursor inside a single transaction,
+    on a connection which is otherwise in autocommit mode.
+    """
+    cursor.execute("begin;")
+    try:
+        yield cursor
+    except Exception:
+        cursor.execute("rollback;")
+        raise
+    cursor.execute("commit;")
+
+
+class JSONCodec(object):
+    def __init__(self, dumps, loads):
+        """
+        Create a JSONCodec, the pair of functions used to encode documents
+        sent to the server and decode jsonb values received from it.
+        Args:
+          - dumps: function from a python value to a json string.
+          - loads: function from a json string to a python value.
+        """
+        self.dumps = dumps
+        self.loads = loads
+
+
+STDLIB_JSON_CODEC = JSONCodec(json.dumps, json.loads)
+
+
+def _get_json_codec(json_codec):
+    """
+    Resolve the json_codec argument of a client: None for the standard
+    library json module, 'auto' for the fastest installed implementation,
+    or any object (such as a module) with `dumps` and `loads` functions.
+    """
+    if json_codec is None:
+        return STDLIB_JSON_CODEC
+    if json_codec == 'auto':
+        try:
+            import orjson
+            return JSONCodec(_orjson_dumps, orjson.loads)
+        except ImportError:
+            pass
+        try:
+            import ujson
+            return JSONCodec(ujson.dumps, ujson.loads)
+        except ImportError:
+            pass
+        return STDLIB_JSON_CODEC
+    if isinstance(json_codec, JSONCodec):
+        return json_codec
+    return JSONCodec(json_codec.dumps, json_codec.loads)
+
+
+def _orjson_dumps(value):
+    import orjson
+    return orjson.dumps(value).decode('utf-8')
+
+
+def _register_json_codec(connection, json_codec):
+    if json_codec is not STDLIB_JSON_CODEC:
+        psycopg2.extras.register_default_jsonb(
+            connection, loads=json_codec.loads)
+
+
+class _ClientConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    A ThreadedConnectionPool which configures each new connection for use
+    by a BedquiltClient.
+    """
+    def __init__(self, json_codec, *args, **kwargs):
+        self.json_codec = json_codec
+        super(_ClientConnectionPool, self).__init__(*args, **kwargs)
+
+    def _connect(self, key=None):
+        connection = super(_ClientConnectionPool, self)._connect(key)
+        connection.autocommit = True
+        _register_json_codec(connection, self.json_codec)
+        return connection
+
+
+class DocumentCache(object):
+
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        Create a DocumentCache, a thread-safe LRU cache of documents
+        keyed by (collection_name, _id), used by BedquiltClient to answer
+        find_one_by_id without a round trip to the server.
+        Args:
+          - max_size: (optional) integer maximum number of documents to
+            keep, evicting the least recently used (default 1024).
+          - ttl: (optional) number of seconds after which a cached
+            document expires (default None, never expires).
+        """
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # bumped on every invalidation, see version()
+        self._version = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, collection_name, doc_id):
+        """
+        Get a copy of a cached document.
+        Returns: A dictionary if cached, or None.
+        """
+        key = (collection_name, doc_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            doc, expires = entry
+            if expires is not None and expires <= _now():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+        return copy.deepcopy(doc)
+
+    def version(self):
+        """
+        Get the current version of the cache, which changes whenever
+        documents are invalidated. Pass it to put, to avoid caching a
+        document read before an invalidation of it.
+        Returns: integer
+        """
+        return self._version
+
+    def put(self, collection_name, doc_id, doc, version=None):
+        """
+        Add a copy of a document to the cache.
+        Args:
+          - collection_name: string name of collection.
+          - doc_id: string _id of the document.
+          - doc: dict of the document.
+          - version: (optional) the version of the cache from before the
+            document was read. If the cache has been invalidated since,
+            the document is not added.
+        """
+        key = (collection_name, doc_id)
+        expires = None
+        if self.ttl is not None:
+            expires = _now() + self.ttl
+        entry = (copy.deepcopy(doc), expires)
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, collection_name, doc_ids=None):
+        """
+        Remove documents from the cache.
+        Args:
+          - collection_name: string name of collection.
+          - doc_ids: (optional) list of string _ids to remove. If None,
+            remove every document of the collection.
+        """
+        with self._lock:
+            self._version += 1
+            if doc_ids is None:
+                keys = [key for key in self._entries
+                        if key[0] == collection_name]
+            else:
+                keys = [(collection_name, doc_id) for doc_id in doc_ids]
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        """
+        Remove all documents from the cache.
+        """
+        with self._lock:
+            self._version += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get the counters of the cache.
+        Returns: dict of hits, misses, evictions, expirations,
+        invalidations and the current size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries)
+            }
+
+class OperationEvent(object):
+    """
+    An operation of a BedquiltClient on the database server, passed to
+    the `started` and `finished` methods of its listeners.
+    Attributes:
+      - operation: string name of the bq_* function called, such as
+        'bq_find', or 'pipeline'.
+      - collection: string name of the collection, or None.
+      - query: sql string of the operation.
+      - params: tuple of parameters of the query.
+      - duration: float seconds the operation took, or None until it
+        has finished. For cursors this covers the whole iteration, until
+        the cursor is exhausted or closed.
+      - rows: integer number of rows returned, or None until finished.
+      - bytes_sent: integer size of the statement sent to the server,
+        or None until finished.
+      - bytes_received: integer size in bytes of the json documents
+        received, encoded as utf-8.
+      - error: the exception the operation raised, or None.
+    """
+    def __init__(self, operation, collection, query, params):
+        self.operation = operation
+        self.collection = collection
+        self.query = query
+        self.params = params
+        self.duration = None
+        self.rows = None
+        self.bytes_sent = None
+        self.bytes_received = 0
+        self.error = None
+        self._started = None
+
+    def __repr__(self):
+        return "OperationEvent({!r}, {!r}, duration={!r}, rows={!r})".format(
+            self.operation, self.collection, self.duration, self.rows)
+
+
+class OperationListener(object):
+    """
+    Base class for listeners passed to BedquiltClient.add_listener.
+    Override either or both methods.
+    """
+    def started(self, event):
+        """
+        Called with an OperationEvent before an operation is sent to the
+        server.
+        """
+        pass
+
+    def finished(self, event):
+        """
+        Called with an OperationEvent after an operation has completed
+        or failed.
+        """
+        pass
+
+
+class SlowOperationLog(OperationListener):
+
+    # the bq_* functions which only read, and the names of their arguments
+    READ_OPERATIONS = {
+        'bq_find': ('collection', 'query_doc', 'skip', 'limit', 'sort'),
+        'bq_find_one': ('collection', 'query_doc', 'skip', 'sort'),
+        'bq_find_one_by_id': ('collection', 'doc_id'),
+        'bq_find_many_by_ids': ('collection', 'doc_ids'),
+        'bq_count': ('collection', 'query_doc'),
+        'bq_distinct': ('collection', 'key_path'),
+    }
+
+    def __init__(self, threshold, size=100, explain=False, client=None):
+        """
+        Create a SlowOperationLog, a listener which keeps the most recent
+        operations taking longer than a threshold in a ring buffer, and
+        logs each of them as a warning on the 'pybedquilt.core' logger.
+        Args:
+          - threshold: number of seconds an operation must take to be
+            recorded.
+          - size: (optional) integer number of entries to keep
+            (default 100).
+          - explain: (optional) boolean, re-run slow reads with the
+            auto_explain module, to capture the EXPLAIN (ANALYZE, BUFFERS)
+            plans of the queries the bq_* functions run. Plans are
+            captured by a background thread on a connection of its own,
+            so the operation returns without waiting for them, and are
+            added to its entry once captured (see flush). This needs
+            PostgreSQL 12 or later, and a superuser or auto_explain in
+            session_preload_libraries (default False). ANALYZE executes
+            each read a second time, in a transaction which is rolled
+            back; writes are never re-run, as their locks and side
+            effects such as advanced sequences would be repeated.
+          - client: (optional) the BedquiltClient to connect with, which
+            is required for explain.
+        """
+        assert threshold >= 0
+        assert size > 0
+        assert client is not None or not explain, \
+            "explain requires a client"
+        self.threshold = threshold
+        self.explain = explain
+        self.client = client
+        self._entries = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._capturer = None
+        self._closed = False
+
+    def finished(self, event):
+        if event.duration < self.threshold:
+            return
+        entry = {
+            'time': time.time(),
+            'operation': event.operation,
+            'collection': event.collection,
+            'duration': event.duration,
+            'rows': event.rows,
+            'error': None if event.error is None else repr(event.error),
+            'args': _operation_args(event, self.READ_OPERATIONS),
+            'plans': None,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if (self.explain and not self._closed and event.error is None
+                    and event.operation in self.READ_OPERATIONS):
+                if self._capturer is None:
+                    self._capturer = _PlanCapturer(
+                        self.client._new_connection, self._lock,
+                        self._entries.maxlen)
+                    self._capturer.start()
+                # if too many are waiting, the entry is left without plans
+                self._capturer.submit(entry, event)
+        logger.warning("Slow operation %s on %s took %.3fs",
+                       event.operation, event.collection, event.duration,
+                       extra={'bedquilt_operation': entry})
+
+    def entries(self):
+        """
+        Get the recorded slow operations, oldest first.
+        Returns: list of dicts, with the keys 'time', 'operation',
+        'collection', 'duration', 'rows', 'error', 'args' (a dict of the
+        arguments of the bq_* function, such as 'query_doc', 'sort',
+        'skip' and 'limit') and 'plans' (a list of plans, or None until
+        they are captured).
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        """
+        Remove all recorded slow operations.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def flush(self):
+        """
+        Wait until the plans of the slow operations recorded so far have
+        been captured.
+        """
+        with self._lock:
+            capturer = self._capturer
+        if capturer is not None:
+            capturer.pending.join()
+
+    def close(self):
+        """
+        Stop capturing plans, and close the connection used to capture
+        them, if any. Plans which have not been captured yet are not.
+        Called by BedquiltClient.close.
+        """
+        with self._lock:
+            self._closed = True
+            capturer, self._capturer = self._capturer, None
+        if capturer is not None:
+            capturer.stop()
+            capturer.join()
+
+
+class _PlanCapturer(threading.Thread):
+    """
+    A background thread which captures the plans of slow operations for
+    a SlowOperationLog on its own connection, one at a time, and adds
+    them to their entries.
+    """
+    def __init__(self, connect, lock, size):
+        super(_PlanCapturer, self).__init__(
+            name='pybedquilt-plan-capturer')
+        self.daemon = True
+        self.connect = connect
+        self.lock = lock
+        self.pending = queue.Queue(size)
+        self._stopping = threading.Event()
+
+    def submit(self, entry, event):
+        try:
+            self.pending.put_nowait((entry, event))
+        except queue.Full:
+            pass
+
+    def stop(self):
+        # the operations still waiting are skipped, up to the None
+        self._stopping.set()
+        self.pending.put(None)
+
+    def run(self):
+        connection = None
+        try:
+            while True:
+                item = self.pending.get()
+                try:
+                    if item is None:
+                        return
+                    if self._stopping.is_set():
+                        continue
+                    entry, event = item
+                    if connection is None or connection.closed:
+                        connection = self.connect()
+                    plans = _capture_plans(
+                        connection.cursor(), event.query, event.params)
+                    with self.lock:
+                        entry['plans'] = plans
+                except Exception:
+                    logger.exception(
+                        "Could not capture plans of slow operation")
+                    if connection is not None:
+                        connection.close()
+                finally:
+                    self.pending.task_done()
+        finally:
+            if connection is not None:
+                connection.close()
+
+
+class _InvalidationListener(threading.Thread):
+    """
+    A background thread which LISTENs for invalidation notifications
+    on its own connection, and removes the documents they name from
+    a DocumentCache.
+    """
+    def __init__(self, cache, connect, poll_interval=1.0):
+        super(_InvalidationListener, self).__init__(
+            name='pybedquilt-invalidation-listener')
+        self.daemon = True
+        self.cache = cache
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.listening = threading.Event()
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                connection.autocommit = True
+                connection.cursor().execute(
+                    "listen {};".format(INVALIDATION_CHANNEL))
+                # notifications may have been missed while not listening
+                self.cache.clear()
+                self.listening.set()
+                self._listen(connection)
+            except Exception:
+                logger.warning("Cache invalidation listener failed, "
+                               "reconnecting", exc_info=True)
+                self.listening.clear()
+                self.cache.clear()
+                self._stopping.wait(self.poll_interval)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _listen(self, connection):
+        while not self._stopping.is_set():
+            if select.select([connection], [], [],
+                             self.poll_interval) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                self._invalidate(notify.payload)
+
+    def _invalidate(self, payload):
+        message = json.loads(payload)
+        doc_ids = None
+        if message.get('_id') is not None:
+            doc_ids = [message['_id']]
+        self.cache.invalidate(message['collection'], doc_ids)
+
+
 class BedquiltCursor(object):
-    def __init__(self, collection, query, params):
+    def __init__(self, collection, query, params, stream=None,
+                 batch_size=None, raw=False, connection=None,
+                 operation=None):
+        """
+        Create a BedquiltCursor, executing the query.
+        Args:
+          - collection: instance of BedquiltCollection.
+          - query: sql string to execute.
+          - params: tuple of parameters for the query.
+          - stream: (optional) boolean, whether to use a server-side cursor
+            which fetches rows in batches, rather than loading the entire
+            result set into memory. Defaults to the `stream` setting
+            of the client. On a client with a pool, a streaming cursor
+            runs in a transaction on a connection checked out of the pool.
+            On a client without one, it is declared WITH HOLD on the
+            client's connection, so that other operations can run while
+            it is open; the server then computes the whole result when
+            the cursor is declared, though it is still fetched in batches.
+          - batch_size: (optional) integer number of rows to fetch and
+            decode at a time. Defaults to the `itersize` of the client.
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+          - connection: (optional) an autocommit connection of the
+            cursor's own to stream on, instead of the client's, which is
+            closed with the cursor.
+          - operation: (optional) string name of the operation, for
+            listeners. Defaults to the bq_* function the query calls.
+        """
         self.collection = collection
-        self.cursor = collection.client.connection.cursor()
-        self.cursor.execute(query, params)
+        client = collection.client
+        if stream is None:
+            stream = client.stream
+        self.stream = stream
+        self.raw = raw
+        self.batch_size = batch_size or client.itersize
+        self._buffer = []
+        self._position = 0
+        self._rows = 0
+        self._event = None
+        self._dedicated = connection is not None
+        self._connection = connection
+        if connection is None:
+            self._connection = client._checkout()
+        # a cursor without hold streams rows as the query produces them,
+        # but only lives as long as the transaction, so it cannot be used
+        # on the client's single connection, which other operations share
+        self._transaction = stream and (self._dedicated
+                                        or client.pool is not None)
+        try:
+            if self._transaction:
+                self._connection.autocommit = False
+                self.cursor = self._connection.cursor(_cursor_name())
+            elif stream:
+                self.cursor = self._connection.cursor(_cursor_name(),
+                                                      withhold=True)
+            else:
+                self.cursor = self._connection.cursor()
+            if raw:
+                psycopg2.extensions.register_type(RAW_JSONB, self.cursor)
+            self._event = client._start_event(
+                self.cursor, query, params, raw, operation,
+                collection=collection.collection_name)
+            # prepared statements cannot be declared as named cursors
+            client._execute(self.cursor, query, params, prepare=not stream)
+        except Exception as e:
+            self._finish_event(e)
+            self._release(commit=False)
+            raise
+        if not stream:
+            # the whole result is already held by the cursor, so the
+            # connection is free for other operations
+            self._release()
 
     def __iter__(self):
         return self
 
     def next(self):
-        n = self.cursor.fetchone()
-        if n:
-            return _unpack_row(n)
-        else:
-            raise StopIteration
+        if self._position >= len(self._buffer):
+            self._buffer = self._fetch_batch()
+            self._position = 0
+            if not self._buffer:
+                raise StopIteration
+        doc = self._buffer[self._position]
+        self._position += 1
+        return doc
+
+    __next__ = next
 
-    def __next__(self):
-        n = self.cursor.fetchone()
-        if n:
-            return _unpack_row(n)
+    def next_batch(self):
+        """
+        Get the next batch of documents from the cursor.
+        Returns: list of up to `batch_size` documents, or an empty
+        list when the cursor is exhausted.
+        """
+        if self._position < len(self._buffer):
+            batch = self._buffer[self._position:]
         else:
-            raise StopIteration
+            batch = self._fetch_batch()
+        self._buffer = []
+        self._position = 0
+        return batch
+
+    def iter_batches(self):
+        """
+        Iterate over the remaining documents in batches.
+        Returns: generator of lists of documents.
+        """
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            yield batch
+
+    def decode_with(self, executor, chunk_size=None, prefetch=4):
+        """
+        Iterate over the remaining documents, decoding them in chunks on
+        an executor, such as a concurrent.futures.ProcessPoolExecutor, so
+        that decoding large documents can use several cores. Documents
+        are yielded in order, as soon as their chunk is decoded.
+        The cursor must have been created with raw=True.
+        Args:
+          - executor: a concurrent.futures.Executor.
+          - chunk_size: (optional) integer number of documents to decode
+            per task. Defaults to the `batch_size` of the cursor.
+          - prefetch: (optional) integer number of chunks to fetch and
+            submit ahead of the one being yielded (default 4).
+        Returns: generator of documents.
+        Example:
+          - with ProcessPoolExecutor() as executor:
+                cursor = collection.find(stream=True, raw=True)
+                for doc in cursor.decode_with(executor):
+                    ...
+        """
+        assert self.raw, "decode_with requires a cursor with raw=True"
+        assert prefetch > 0
+        if chunk_size is not None:
+            self.batch_size = chunk_size
+        loads = self.collection.client.json_codec.loads
+        pending = collections.deque()
+        try:
+            batches = self.iter_batches()
+            for batch in batches:
+                pending.append(executor.submit(_decode_chunk, loads, batch))
+                if len(pending) > prefetch:
+                    for doc in pending.popleft().result():
+                        yield doc
+            while pending:
+                for doc in pending.popleft().result():
+                    yield doc
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """
+        Close the underlying database cursor, releasing any
+        server-side resources, and return the connection to the
+        client's pool.
+        """
+        self._close()
+
+    def _close(self, error=None):
+        try:
+            if not self.cursor.closed:
+                self.cursor.close()
+        finally:
+            self._release(commit=error is None)
+            self._finish_event(error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, '_connection', None) is not None:
+            self.close()
+
+    def _release(self, commit=True):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._dedicated:
+            connection.close()
+            return
+        try:
+            if self._transaction:
+                _end_transaction(connection, commit)
+        finally:
+            self.collection.client._checkin(connection)
+
+    def _finish_event(self, error=None):
+        if self._event is not None:
+            event, self._event = self._event, None
+            self.collection.client._finish_event(
+                event, self.cursor, self._rows, error)
+
+    def _fetch_batch(self):
+        if self.cursor.closed:
+            return []
+        try:
+            rows = self.cursor.fetchmany(self.batch_size)
+        except Exception as e:
+            self._close(e)
+            raise
+        self._rows += len(rows)
+        if len(rows) < self.batch_size:
+            self.close()
+        return _unpack_rows(rows)
 
 
 class BedquiltClient(object):
 
-    def __init__(self, dsn=None, connection=None, spec=None, **kwargs):
+    def __init__(self, dsn=None, connection=None, spec=None,
+                 stream=False, itersize=2000, pool_size=None,
+                 json_codec=None, prepare=False, cache_size=None,
+                 cache_ttl=None, cache_listen=False, lazy=False,
+                 pool_timeout=30, **kwargs):
         """
         Create a BedquiltClient object, connecting to the database server.
+        The bedquilt extension is checked once per server for the life of
+        the process, not by every client.
         Args:
           - dsn: A psycopg2-style dsn string
+          - connection: (optional) an open psycopg2 connection to use
+            instead of connecting with dsn.
+          - stream: (optional) boolean, whether cursors returned by find,
+            find_many_by_ids and distinct should stream results from a
+            server-side cursor by default (default False).
+          - itersize: (optional) integer number of rows to fetch and
+            decode at a time when iterating a cursor (default 2000).
+          - pool_size: (optional) integer, if set, the client keeps a
+            thread-safe pool of this many connections, and each operation
+            or cursor checks out its own connection from the pool.
+          - json_codec: (optional) the json implementation used to encode
+            and decode documents. Either 'auto', to use the fastest
+            installed of orjson and ujson, an object (such as a module)
+            with `dumps` and `loads` functions, or a JSONCodec.
+            Defaults to the standard library json module.
+          - prepare: (optional) boolean, PREPARE each statement once per
+            connection, and EXECUTE it from then on, saving the server
+            from parsing and planning it on every call (default False).
+            Up to MAX_PREPARED_STATEMENTS statements are kept prepared on
+            each connection, the least recently used are deallocated.
+          - cache_size: (optional) integer, if set, the client keeps a
+            DocumentCache of up to this many documents, answering
+            find_one_by_id from memory. Entries are invalidated by writes
+            made through this client.
+          - cache_ttl: (optional) number of seconds after which cached
+            documents expire (default None, never expires).
+          - cache_listen: (optional) boolean, LISTEN for invalidations on
+            a background connection, so that cached documents changed
+            by other clients and processes are evicted too. See
+            BedquiltCollection.add_invalidation_trigger (default False).
+          - lazy: (optional) boolean, defer connecting to the server until
+            the first operation (default False).
+          - pool_timeout: (optional) number of seconds to wait for a pooled
+            connection to become free, before raising a PoolError, or None
+            to wait indefinitely (default 30).
         Example:
           - BedquiltClient("dbname=test")
+          - BedquiltClient("dbname=test", pool_size=8)
+          - BedquiltClient("dbname=test", json_codec='auto')
+          - BedquiltClient("dbname=test", cache_size=10000, cache_ttl=60)
         """
-        self.connection = None
+        self._conn = None
+        self._pool = None
+        self.stream = stream
+        self.itersize = itersize
+        self.json_codec = _get_json_codec(json_codec)
+        self.prepare = prepare
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self._listeners = []
+        # connection -> OrderedDict of query string -> name of the
+        # statements prepared on it, least recently used first
+        self._prepared = weakref.WeakKeyDictionary()
+        self.cache = None
+        if cache_size is not None:
+            self.cache = DocumentCache(cache_size, cache_ttl)
+        assert self.cache is not None or not cache_listen, \
+            "cache_listen requires a cache_size"
+        self._listener = None
 
-        if (connection is not None
+        if pool_size is not None:
+            assert pool_size > 0
+            if not (isinstance(dsn, six.string_types) or kwargs):
+                raise Exception("Cannot create connection pool")
+            # the pool raises when exhausted, so make callers wait instead
+            self._pool_slots = threading.BoundedSemaphore(pool_size)
+        elif (connection is not None
             and isinstance(connection, psycopg2._psycopg.connection)):
-            self.connection = connection
-        elif dsn is not None and isinstance(dsn, six.string_types):
-            self.connection = psycopg2.connect(dsn)
-        elif kwargs:
-            self.connection = psycopg2.connect(**kwargs)
-        else:
+            assert not lazy, "Cannot lazily connect a given connection"
+        elif not (isinstance(dsn, six.string_types) or kwargs):
             raise Exception("Cannot create connection")
+        self._connect_args = (dsn, connection, pool_size, kwargs)
+        self._connected = False
+        self._connect_lock = threading.Lock()
+
+        if not lazy:
+            self._connect()
+
+        if cache_listen:
+            self._listener = _InvalidationListener(
+                self.cache, self._new_connection)
+            self._listener.start()
+
+    @property
+    def connection(self):
+        """
+        The connection to the database server, or None if the client
+        has a connection pool.
+        """
+        self._connect()
+        return self._conn
+
+    @property
+    def pool(self):
+        """
+        The pool of connections to the database server, or None if the
+        client has a single connection.
+        """
+        self._connect()
+        return self._pool
+
+    def _new_connection(self):
+        """
+        Open a new autocommit connection to the database server, outside
+        of the client's connection or pool.
+        """
+        dsn, connection, _, kwargs = self._connect_args
+        if connection is not None and dsn is None:
+            # the password of a connection's dsn is obscured, so
+            # this only works for connections which do not need one
+            dsn, kwargs = connection.dsn, {}
+        connection = psycopg2.connect(dsn, **kwargs)
+        connection.autocommit = True
+        return connection
+
+    def _connect(self):
+        """
+        Connect to the database server and bootstrap the client, unless
+        that has already been done.
+        """
+        if self._connected:
+            return
+        with self._connect_lock:
+            if self._connected:
+                return
+            dsn, connection, pool_size, kwargs = self._connect_args
+            if pool_size is not None:
+                if isinstance(dsn, six.string_types):
+                    self._pool = _ClientConnectionPool(
+                        self.json_codec, pool_size, pool_size, dsn)
+                else:
+                    self._pool = _ClientConnectionPool(
+                        self.json_codec, pool_size, pool_size, **kwargs)
+                connection = self._pool.getconn()
+            else:
+                if (connection is not None
+                    and isinstance(connection, psycopg2._psycopg.connection)):
+                    self._conn = connection
+                elif isinstance(dsn, six.string_types):
+                    self._conn = psycopg2.connect(dsn)
+                else:
+                    self._conn = psycopg2.connect(**kwargs)
+                self._conn.autocommit = True
+                _register_json_codec(self._conn, self.json_codec)
+                connection = self._conn
+
+            try:
+                self._bootstrap(connection)
+            except Exception:
+                if self._pool is not None:
+                    self._pool.closeall()
+                elif self._conn is not self._connect_args[1]:
+                    self._conn.close()
+                self._pool = self._conn = None
+                raise
+            if self._pool is not None:
+                self._pool.putconn(connection)
+            self._connected = True
+
+    def _checkout(self):
+        """
+        Get a connection to run an operation on. Must be handed back
+        with _checkin.
+        """
+        self._connect()
+        if self._pool is None:
+            return self._conn
+        if not _acquire(self._pool_slots, self.pool_timeout):
+            raise psycopg2.pool.PoolError(
+                "Timed out waiting for a pooled connection, all {} are "
+                "in use".format(self.pool_size))
+        try:
+            connection = self._pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+        return connection
+
+    def _checkin(self, connection):
+        if self._pool is None:
+            return
+        try:
+            if connection.closed:
+                self._prepared.pop(connection, None)
+            self._pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self._pool_slots.release()
+
+    @contextlib.contextmanager
+    def _connection(self):
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+
+    def enable_slow_log(self, threshold, size=100, explain=False):
+        """
+        Record operations which take longer than a threshold, in a
+        SlowOperationLog which is added as a listener of this client.
+        Args:
+          - threshold: number of seconds an operation must take to be
+            recorded.
+          - size: (optional) integer number of the most recent slow
+            operations to keep (default 100).
+          - explain: (optional) boolean, also capture the plans of slow
+            reads. See SlowOperationLog (default False).
+        Returns: Instance of SlowOperationLog.
+        Example:
+          - slow_log = client.enable_slow_log(0.5)
+            ...
+            for entry in slow_log.entries():
+                print(entry['operation'], entry['duration'])
+        """
+        slow_log = SlowOperationLog(threshold, size, explain, client=self)
+        self.add_listener(slow_log)
+        return slow_log
+
+    def add_listener(self, listener):
+        """
+        Add a listener, whose `started` and `finished` methods are called
+        with an OperationEvent before and after each operation the client
+        sends to the server. See OperationListener.
+        Args:
+          - listener: object with `started` and `finished` methods.
+        Returns: None
+        Example:
+          - class Timer(OperationListener):
+                def finished(self, event):
+                    print(event.operation, event.duration)
+            client.add_listener(Timer())
+        """
+        assert hasattr(listener, 'started') and hasattr(listener, 'finished')
+        # replaced rather than appended to, for iteration without a lock
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        """
+        Remove a listener added with add_listener.
+        Args:
+          - listener: the listener to remove.
+        Returns: None
+        """
+        listeners = list(self._listeners)
+        listeners.remove(listener)
+        self._listeners = listeners
+
+    def _start_event(self, cursor, query_string, params, raw=False,
+                     operation=None, collection=None):
+        """
+        Notify listeners of an operation about to run on cursor.
+        Returns: OperationEvent, or None if there are no listeners.
+        """
+        listeners = self._listeners
+        if not listeners:
+            return None
+        if operation is None:
+            operation = _operation_name(query_string)
+        event = OperationEvent(operation, collection, query_string, params)
+        # decode jsonb on this cursor with a typecaster which also counts
+        # the size of the documents received
+        loads = (lambda value: value) if raw else self.json_codec.loads
 
-        self.connection.autocommit = True
+        def typecast(value, cursor):
+            if value is None:
+                return None
+            event.bytes_received += len(
+                value if isinstance(value, bytes) else value.encode('utf-8'))
+            return loads(value)
+        psycopg2.extensions.register_type(psycopg2.extensions.new_type(
+            (JSONB_OID,), 'BQ_COUNTING_JSONB', typecast), cursor)
 
-        self._bootstrap()
+        for listener in listeners:
+            _notify(listener.started, event)
+        event._started = _now()
+        return event
 
-        assert self.connection is not None
+    def _finish_event(self, event, cursor, rows=None, error=None):
+        """
+        Notify listeners that the operation of event has finished.
+        """
+        if event is None:
+            return
+        event.duration = _now() - event._started
+        event.rows = rows
+        event.error = error
+        if cursor.query is not None:
+            event.bytes_sent = len(cursor.query)
+        for listener in self._listeners:
+            _notify(listener.finished, event)
+
+    def _query(self, query_string, params=None, raw=False, operation=None,
+               collection=None):
+        with self._connection() as connection:
+            return self._fetchall(connection.cursor(), query_string, params,
+                                  raw, operation, collection)
+
+    def _fetchall(self, cursor, query_string, params=None, raw=False,
+                  operation=None, collection=None, prepare=True):
+        """
+        Execute query_string on cursor, notifying any listeners. Pass
+        prepare=False for generated statements which are unlikely to be
+        run again, so that they are not prepared.
+        Returns: list of all rows of the result.
+        """
+        if raw:
+            psycopg2.extensions.register_type(RAW_JSONB, cursor)
+        event = self._start_event(cursor, query_string, params, raw,
+                                  operation, collection)
+        try:
+            self._execute(cursor, query_string, params, prepare)
+            result = cursor.fetchall()
+        except Exception as e:
+            self._finish_event(event, cursor, error=e)
+            raise
+        self._finish_event(event, cursor, len(result))
+        return result
+
+    def _execute(self, cursor, query_string, params=None, prepare=True):
+        """
+        Execute query_string on cursor, as a prepared statement if the
+        client is set to prepare statements. Statements inside a
+        transaction are never prepared, as a failed EXECUTE aborts the
+        transaction, and so cannot be retried.
+        """
+        if not (self.prepare and prepare and params) or (
+                cursor.connection.get_transaction_status()
+                != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            cursor.execute(query_string, params)
+            return
+
+        prepared = self._prepared.get(cursor.connection)
+        if prepared is None:
+            prepared = self._prepared[cursor.connection] = (
+                collections.OrderedDict())
+        name = prepared.pop(query_string, None)
+        if name is None:
+            name, statement = _prepared_statement(query_string)
+            self._prepare(cursor, name, statement)
+            while len(prepared) >= MAX_PREPARED_STATEMENTS:
+                self._deallocate(cursor, prepared.popitem(last=False)[1])
+        prepared[query_string] = name
+        execute_string = "execute {}({});".format(
+            name, ", ".join(["%s"] * len(params)))
+        try:
+            cursor.execute(execute_string, params)
+        except psycopg2.Error as e:
+            # the server has dropped our prepared statements, for example
+            # after a DEALLOCATE ALL or a reset by a connection pooler
+            if e.pgcode != INVALID_SQL_STATEMENT_NAME:
+                raise
+            prepared.clear()
+            self._prepare(cursor, *_prepared_statement(query_string))
+            prepared[query_string] = name
+            cursor.execute(execute_string, params)
+
+    def _prepare(self, cursor, name, statement):
+        try:
+            cursor.execute("prepare {} as {};".format(name, statement))
+        except psycopg2.Error as e:
+            # already prepared on this connection, by another client
+            if e.pgcode != DUPLICATE_PREPARED_STATEMENT:
+                raise
+
+    def _deallocate(self, cursor, name):
+        try:
+            cursor.execute("deallocate {};".format(name))
+        except psycopg2.Error as e:
+            # already deallocated, by another client on this connection
+            if e.pgcode != INVALID_SQL_STATEMENT_NAME:
+                raise
+
+    def close(self):
+        """
+        Close the connection, or all pooled connections, to the
+        database server.
+        """
+        self._prepared.clear()
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.join()
+        for listener in self._listeners:
+            if isinstance(listener, SlowOperationLog):
+                listener.close()
+        if self._pool is not None:
+            self._pool.closeall()
+        elif self._conn is not None:
+            self._conn.close()
 
-    def _bootstrap(self):
+    def _bootstrap(self, connection):
         """
         Do whatever needs to be done to bootstrap/initialize the client.
+        This is done once per server, identified by the dsn of the
+        connection.
         """
-        cursor = self.connection.cursor()
-        cursor.execute("""
+        if connection.dsn in _BOOTSTRAPPED:
+            return
+        cursor = connection.cursor()
+
+        result = _query(cursor, """
         select * from pg_catalog.pg_extension
         where extname = 'bedquilt';
         """)
-        result = cursor.fetchall()
 
         assert (result is not None and len(result) > 0), \
             "Bedquilt extension not found on database server"
 
-        cursor.execute("""
+        _ = _query(cursor, """
         select bq_util_assert_minimum_version('{}')
         """.format(MIN_SERVER_VERSION))
-        _ = cursor.fetchall()
+
+        _BOOTSTRAPPED.add(connection.dsn)
 
     def create_collection(self, collection_name):
         """
@@ -93,9 +1266,9 @@ class BedquiltClient(object):
         Returns:
           - Boolean representing whether the collection was created or not.
         """
-        result = _query(self.connection.cursor(), """
+        result = self._query("""
         select bq_create_collection(%s)
-        """, (collection_name,))
+        """, (collection_name,), collection=collection_name)
         return result[0][0]
 
     def delete_collection(self, collection_name):
@@ -106,18 +1279,26 @@ class BedquiltClient(object):
         Returns:
           - Boolean representing whether the collection was deleted or not.
         """
-        result = _query(self.connection.cursor(), """
+        result = self._query("""
         select bq_delete_collection(%s)
-        """, (collection_name,))
+        """, (collection_name,), collection=collection_name)
+        self._invalidate(collection_name)
         return result[0][0]
 
+    def _invalidate(self, collection_name, doc_ids=None):
+        """
+        Remove documents from the client's cache, if it has one.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(collection_name, doc_ids)
+
     def list_collections(self):
         """
         Get a list collections on the database server.
         Args: None
         Returns: List of string names of collections.
         """
-        result = _query(self.connection.cursor(), """
+        result = self._query("""
         select bq_list_collections();
         """)
 
@@ -130,9 +1311,9 @@ class BedquiltClient(object):
           - collection_name: string name of collection.
         Returns: Boolean
         """
-        result = _query(self.connection.cursor(), """
+        result = self._query("""
         select bq_collection_exists(%s)
-        """, (collection_name,))
+        """, (collection_name,), collection=collection_name)
         return result[0][0]
 
     def collection(self, collection_name):
@@ -147,6 +1328,26 @@ class BedquiltClient(object):
     def __getitem__(self, collection_name):
         return self.collection(collection_name)
 
+    def pipeline(self, transaction=True, batch_size=None):
+        """
+        Get a BedquiltPipeline, which queues insert, save, remove*, count
+        and find_one* operations on any collection, then sends them to
+        the server in as few round trips as possible.
+        Args:
+          - transaction: (optional) boolean, run all operations in a
+            single transaction (default True). False requires a
+            batch_size, as a single statement is always atomic.
+          - batch_size: (optional) integer maximum number of operations to
+            send per statement (default None, all in one statement).
+        Returns: Instance of BedquiltPipeline.
+        Example:
+          - with client.pipeline() as pipeline:
+                one = pipeline['people'].insert({'name': 'Sarah'})
+                two = pipeline['things'].remove_one_by_id('lamp')
+            one.result()
+        """
+        return BedquiltPipeline(self, transaction, batch_size)
+
 
 class BedquiltCollection(object):
 
@@ -159,13 +1360,28 @@ class BedquiltCollection(object):
         """
         self.client = client
         self.collection_name = collection_name
-        self.cursor = client.connection.cursor()
+        self._dumps = client.json_codec.dumps
+
+    def _query(self, query_string, params, raw=False):
+        return self.client._query(query_string, params, raw,
+                                  collection=self.collection_name)
 
-    def _query(self, query_string, params):
-        return _query(self.cursor, query_string, params)
+    def batch(self, transaction=True, batch_size=None):
+        """
+        Get a PipelineCollection for this collection, on a new pipeline.
+        See BedquiltClient.pipeline.
+        Returns: Instance of PipelineCollection.
+        Example:
+          - with collection.batch() as batch:
+                one = batch.insert({'name': 'Sarah'})
+                two = batch.remove_one_by_id('mike@example.com')
+        """
+        return self.client.pipeline(
+            transaction, batch_size).collection(self.collection_name)
 
     # Read
-    def find(self, query_doc=None, skip=0, limit=None, sort=None):
+    def find(self, query_doc=None, skip=0, limit=None, sort=None,
+             stream=None, raw=False, projection=None, batch_size=None):
         """
         Find documents in collection.
         Args:
@@ -173,6 +1389,16 @@ class BedquiltCollection(object):
           - skip: (optional) integer number of documents to skip (default 0).
           - limit: (optional) integer number of documents to limit result set to (default None).
           - sort: (optional) list of dict, representing sort specification.
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
+          - batch_size: (optional) integer number of rows to fetch and
+            decode at a time. Defaults to the `itersize` of the client.
         Returns: BedquiltCursor
         """
         if query_doc is None:
@@ -181,20 +1407,195 @@ class BedquiltCollection(object):
 
         if sort is not None:
             assert type(sort) is list
-            sort = json.dumps(sort)
+            sort = self._dumps(sort)
 
-        return BedquiltCursor(self, """
-        select bq_find(%s, %s::jsonb, %s, %s, %s::jsonb);
-        """, (self.collection_name, json.dumps(query_doc),
-              skip, limit, sort))
+        query_string, params = _project("""
+        bq_find(%s, %s::jsonb, %s, %s, %s::jsonb)
+        """, projection)
+        return BedquiltCursor(self, query_string, params + (
+            self.collection_name, self._dumps(query_doc),
+            skip, limit, sort), stream=stream, batch_size=batch_size,
+            raw=raw)
 
-    def find_one(self, query_doc=None, skip=0, sort=None):
+    def parallel_scan(self, query_doc=None, partitions=4, merge=False,
+                      batch_size=None, raw=False):
+        """
+        Find documents in collection, split into disjoint partitions by
+        the blocks of the collection's table they are stored in, each
+        streamed from its own server-side cursor on its own connection.
+        The partitions are queried concurrently, so that several server
+        processes and client threads share the work of a large scan. On
+        PostgreSQL 14 or later, each partition reads only its own range
+        of blocks; earlier versions scan the whole table in every
+        partition. The query is matched by containment, so it may not
+        use query operators such as '$gt'. Documents moved by updates
+        made during the scan may be found in two partitions, or none.
+        On a client with a pool, each partition checks out a connection,
+        so the pool must have at least `partitions` connections. On a
+        client without one, each partition opens a connection of its own,
+        which is closed with its cursor.
+        Args:
+          - query_doc: dict representing query, without operators.
+          - partitions: (optional) integer number of partitions (default 4).
+          - merge: (optional) boolean, return a single iterator over the
+            documents of all partitions, in no particular order, fed by
+            one thread per partition (default False).
+          - batch_size: (optional) integer number of rows to fetch and
+            decode at a time. Defaults to the `itersize` of the client.
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
+        Returns: list of BedquiltCursor, one per partition, or an iterator
+        of documents if `merge` is True.
+        Example:
+          - for doc in collection.parallel_scan({}, partitions=8, merge=True)
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict and not _has_operators(query_doc), \
+            "parallel_scan does not support query operators"
+        assert partitions > 0
+        if self.client.pool_size is not None:
+            assert partitions <= self.client.pool_size, \
+                "Not enough pooled connections for {} partitions".format(
+                    partitions)
+
+        with self.client._connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+            select pg_catalog.pg_relation_size(c.oid)
+                / current_setting('block_size')::bigint
+            from pg_catalog.pg_class c
+            join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = current_schema() and c.relname = %s;
+            """, (self.collection_name,))
+            result = cursor.fetchall()
+            query_string = psycopg2.sql.SQL("""
+            select bq_jdoc from {table}
+            where ctid >= %s::tid and ctid < %s::tid and bq_jdoc @> %s::jsonb;
+            """).format(table=psycopg2.sql.Identifier(
+                self.collection_name)).as_string(connection)
+        if not result:
+            # no table to scan, bq_find finds nothing in a missing collection
+            query_string = "select bq_find(%s, %s::jsonb);"
+            ranges = [(self.collection_name,)] * partitions
+        else:
+            blocks = result[0][0]
+            # the last range is open, to include blocks added since
+            ranges = [('({},0)'.format(blocks * n // partitions),
+                       '({},0)'.format(blocks * (n + 1) // partitions
+                                       if n + 1 < partitions else 2 ** 32 - 1))
+                      for n in range(partitions)]
+
+        def open_partition(partition):
+            connection = None
+            if self.client.pool is None:
+                connection = self.client._new_connection()
+                _register_json_codec(connection, self.client.json_codec)
+            return BedquiltCursor(
+                self, query_string,
+                ranges[partition] + (self._dumps(query_doc),),
+                stream=True, batch_size=batch_size, raw=raw,
+                connection=connection, operation='parallel_scan')
+
+        cursors = _run_in_threads(
+            [lambda n=n: open_partition(n) for n in range(partitions)],
+            on_error=lambda cursor: cursor.close())
+        if merge:
+            return _merge_cursors(cursors)
+        return cursors
+
+    def find_page(self, query_doc=None, sort=None, limit=100, after=None):
+        """
+        Find a page of documents in collection, using keyset pagination:
+        rather than skipping over the documents of earlier pages, each
+        page seeks straight past the last document of the previous one,
+        so later pages cost the same as the first.
+        The sort is made unique by ordering on '_id' last. Documents
+        which do not have a value at every sort key are not returned.
+        Args:
+          - query_doc: dict representing query.
+          - sort: (optional) list of dict, representing sort specification.
+            The '$created' and '$updated' keys are not supported.
+          - limit: (optional) integer number of documents per page
+            (default 100).
+          - after: (optional) continuation token returned with the
+            previous page, or None for the first page.
+        Returns: tuple of (list of documents, continuation token for the
+        next page, or None if this is the last page).
+        Example:
+          - docs, token = collection.find_page(sort=[{'age': 1}], limit=50)
+          - docs, token = collection.find_page(sort=[{'age': 1}], limit=50,
+                                               after=token)
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+        if sort is None:
+            sort = []
+        assert type(sort) is list
+        assert limit > 0
+
+        sort_keys = []
+        for spec in sort:
+            assert type(spec) is dict and len(spec) == 1
+            key_path, direction = list(spec.items())[0]
+            assert not key_path.startswith('$'), \
+                "Cannot paginate on {}".format(key_path)
+            sort_keys.append((key_path, direction))
+        if '_id' not in [key_path for key_path, _ in sort_keys]:
+            sort_keys.append(('_id', 1))
+        sort_string = self._dumps(
+            [{key_path: direction} for key_path, direction in sort_keys])
+
+        if after is None:
+            branches = [copy.deepcopy(query_doc)]
+        else:
+            values = _parse_page_token(after, sort_keys)
+            branches = _page_branches(query_doc, sort_keys, values)
+            if not branches:
+                return [], None
+        for branch_doc in branches:
+            for key_path, _ in sort_keys:
+                if key_path != '_id':
+                    _add_condition(branch_doc, key_path, '$exists', True)
+
+        # one bq_find per branch, each seeking past the previous page on
+        # a prefix of the sort keys, concatenated in sort order
+        query_string = """
+        select doc from (
+        {}
+        ) as page order by branch, n limit %s;
+        """.format("\n        union all\n        ".join(
+            "select {} as branch, doc, n from "
+            "bq_find(%s, %s::jsonb, 0, %s, %s::jsonb) "
+            "with ordinality as f(doc, n)".format(branch)
+            for branch in range(len(branches))))
+        params = tuple(param for branch_doc in branches for param in (
+            self.collection_name, self._dumps(branch_doc),
+            limit + 1, sort_string))
+        docs = _unpack_rows(self._query(query_string, params + (limit + 1,)))
+
+        token = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            token = _page_token([_key_path_value(docs[-1], key_path)
+                                 for key_path, _ in sort_keys])
+        return docs, token
+
+    def find_one(self, query_doc=None, skip=0, sort=None, raw=False,
+                 projection=None):
         """
         Find a single document in collection.
         Args:
           - query_doc: dict representing query.
           - skip: (optional) integer number of documents to skip (default 0).
           - sort: (optional) list of dict, representing sort specification.
+          - raw: (optional) boolean, return the document as an undecoded
+            json string (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
         Returns: A dictionary if found, or None.
         """
         if query_doc is None:
@@ -203,42 +1604,67 @@ class BedquiltCollection(object):
 
         if sort is not None:
             assert type(sort) is list
-            sort = json.dumps(sort)
+            sort = self._dumps(sort)
 
-        result = self._query("""
-        select bq_find_one(%s, %s::jsonb, %s, %s::jsonb);
-        """, (self.collection_name, json.dumps(query_doc),
-              skip, sort))
+        query_string, params = _project("""
+        bq_find_one(%s, %s::jsonb, %s, %s::jsonb)
+        """, projection)
+        result = self._query(query_string, params + (
+            self.collection_name, self._dumps(query_doc),
+            skip, sort), raw)
 
         if len(result) == 1:
             return _unpack_row(result[0])
         else:
             return None
 
-    def find_one_by_id(self, doc_id):
+    def find_one_by_id(self, doc_id, raw=False, projection=None):
         """
         Find a single document in collection.
         Args:
           - doc_id: string to match against '_id' fields of collection.
+          - raw: (optional) boolean, return the document as an undecoded
+            json string (default False).
+          - projection: (optional) list of strings, key paths (such as
+            'address.city') to select from each document on the server,
+            instead of returning whole documents. The '_id' field is
+            always included, and missing keys are left out.
         Returns: A dictionary if found, or None.
         """
 
         assert isinstance(doc_id, six.string_types)
 
-        result = self._query("""
-        select bq_find_one_by_id(%s, %s);
-        """, (self.collection_name, doc_id))
+        cache = self.client.cache
+        cacheable = cache is not None and not raw and projection is None
+        if cacheable:
+            doc = cache.get(self.collection_name, doc_id)
+            if doc is not None:
+                return doc
+            version = cache.version()
+
+        query_string, params = _project("""
+        bq_find_one_by_id(%s, %s)
+        """, projection)
+        result = self._query(
+            query_string, params + (self.collection_name, doc_id), raw)
 
         if len(result) == 1:
-            return _unpack_row(result[0])
+            doc = _unpack_row(result[0])
+            if cacheable and doc is not None:
+                cache.put(self.collection_name, doc_id, doc, version)
+            return doc
         else:
             return None
 
-    def find_many_by_ids(self, doc_ids):
+    def find_many_by_ids(self, doc_ids, stream=None, raw=False):
         """
         Find many documents whose _ids are in the supplied list.
         Args:
           - doc_ids: list of strings to match against '_id' fields.
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
+          - raw: (optional) boolean, return documents as undecoded json
+            strings (default False).
         Returns: BedquiltCursor
         Example: collection.find_many_by_ids(['one', 'two', 'four'])
         """
@@ -246,7 +1672,8 @@ class BedquiltCollection(object):
 
         return BedquiltCursor(self, """
         select bq_find_many_by_ids(%s, %s::jsonb)
-        """, (self.collection_name, json.dumps(doc_ids)))
+        """, (self.collection_name, self._dumps(doc_ids)),
+            stream=stream, raw=raw)
 
     def count(self, query_doc=None):
         """
@@ -264,16 +1691,18 @@ class BedquiltCollection(object):
 
         result = self._query("""
         select bq_count(%s, %s);
-        """, (self.collection_name, json.dumps(query_doc)))
+        """, (self.collection_name, self._dumps(query_doc)))
 
         return result[0][0]
 
-    def distinct(self, key_path):
+    def distinct(self, key_path, stream=None):
         """
         Get a sequence of the distinct values in this collection,
         at the specified key-path.
         Args:
           - key_path: string specifying the key to look up
+          - stream: (optional) boolean, stream results from a server-side
+            cursor (defaults to the client setting).
         Returns: BedquiltCursor
         Example: collection.distinct('address.city')
         """
@@ -281,7 +1710,89 @@ class BedquiltCollection(object):
 
         return BedquiltCursor(self, """
         select bq_distinct(%s, %s);
-        """, (self.collection_name, key_path))
+        """, (self.collection_name, key_path), stream=stream)
+
+    def explain(self, query_doc=None, skip=0, limit=None, sort=None,
+                analyze=False):
+        """
+        Get the query plans of a find with the same arguments.
+        The bq_* functions plan their queries when they run, so the find
+        is run, in a transaction which is rolled back, with the
+        auto_explain module capturing the plans. This needs PostgreSQL
+        12 or later, and a superuser or auto_explain in
+        session_preload_libraries.
+        Args:
+          - query_doc: dict representing query.
+          - skip: (optional) integer number of documents to skip (default 0).
+          - limit: (optional) integer number of documents to limit result set to (default None).
+          - sort: (optional) list of dict, representing sort specification.
+          - analyze: (optional) boolean, include actual row counts,
+            timings and buffer usage in the plans (default False).
+        Returns: dict with the keys 'plans' (list of json plans, the
+        queries of the bq_* function first), 'seq_scan' (boolean, whether
+        the collection was scanned sequentially), 'index_used' (boolean)
+        and 'indexes' (list of names of the indexes used).
+        Example: collection.explain({'city': 'London'}, sort=[{'age': 1}])
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+
+        if sort is not None:
+            assert type(sort) is list
+            sort = self._dumps(sort)
+
+        return self._explain("""
+        select bq_find(%s, %s::jsonb, %s, %s, %s::jsonb);
+        """, (self.collection_name, self._dumps(query_doc),
+              skip, limit, sort), analyze)
+
+    def explain_count(self, query_doc=None, analyze=False):
+        """
+        Get the query plans of a count with the same arguments.
+        See explain.
+        Args:
+          - query_doc: dict representing query. (optional)
+          - analyze: (optional) boolean, include actual row counts,
+            timings and buffer usage in the plans (default False).
+        Returns: dict, as returned by explain.
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+
+        return self._explain("""
+        select bq_count(%s, %s);
+        """, (self.collection_name, self._dumps(query_doc)), analyze)
+
+    def explain_distinct(self, key_path, analyze=False):
+        """
+        Get the query plans of a distinct with the same arguments.
+        See explain.
+        Args:
+          - key_path: string specifying the key to look up
+          - analyze: (optional) boolean, include actual row counts,
+            timings and buffer usage in the plans (default False).
+        Returns: dict, as returned by explain.
+        """
+        assert isinstance(key_path, six.string_types)
+
+        return self._explain("""
+        select bq_distinct(%s, %s);
+        """, (self.collection_name, key_path), analyze)
+
+    def _explain(self, query_string, params, analyze):
+        with self.client._connection() as connection:
+            plans = _capture_plans(
+                connection.cursor(), query_string, params, analyze)
+        scans = _plan_scans(plans, self.collection_name)
+        indexes = [index for index in scans if index is not None]
+        return {
+            'plans': plans,
+            'seq_scan': None in scans,
+            'index_used': len(indexes) > 0,
+            'indexes': sorted(set(indexes)),
+        }
 
     # Create
     def insert(self, doc):
@@ -294,7 +1805,74 @@ class BedquiltCollection(object):
         assert type(doc) is dict
         result = self._query("""
         select bq_insert(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(doc)))
+        """, (self.collection_name, self._dumps(doc)))
+        return result[0][0]
+
+    def insert_many(self, docs, batch_size=1000):
+        """
+        Insert many dictionaries into collection. Documents are sent to the
+        server in batches, one statement per batch, and all batches are
+        inserted within a single transaction.
+        Args:
+          - docs: list of dicts representing documents to insert.
+          - batch_size: (optional) integer number of documents to send
+            per statement (default 1000).
+        Returns: list of string _ids of saved documents, in the same
+        order as docs.
+        """
+        assert type(docs) is list
+        for doc in docs:
+            assert type(doc) is dict
+        return self._many("bq_insert", docs, batch_size)
+
+    def _many(self, function_name, docs, batch_size):
+        if not docs:
+            return []
+        batches = _batches(docs, batch_size)
+        query_string = _many_query(function_name)
+        if len(batches) == 1:
+            return _unpack_rows(self._query(
+                query_string, (self.collection_name, self._dumps(docs))))
+
+        ids = []
+        with self.client._connection() as connection, \
+                _transaction(connection.cursor()) as cursor:
+            for batch in batches:
+                ids.extend(_unpack_rows(self.client._fetchall(
+                    cursor, query_string,
+                    (self.collection_name, self._dumps(batch)),
+                    collection=self.collection_name)))
+        return ids
+
+    def load(self, source):
+        """
+        Bulk-load documents into collection using the COPY protocol.
+        Documents are streamed into a temporary staging table and then
+        inserted into the collection with a single statement, applying
+        the same _id generation and constraints as insert.
+        Args:
+          - source: an iterable of dicts, or a file-like object containing
+            one json document per line.
+        Returns: integer number of documents loaded.
+        """
+        if hasattr(source, 'read'):
+            lines = _json_lines(source)
+        else:
+            lines = (self._dumps(doc) for doc in _checked_docs(source))
+        staging_table = 'bq_load_{}'.format(uuid.uuid4().hex)
+
+        with self.client._connection() as connection, \
+                _transaction(connection.cursor()) as cursor:
+            cursor.execute("""
+            create temporary table {} (doc jsonb) on commit drop;
+            """.format(staging_table))
+            cursor.copy_expert(
+                "copy {} (doc) from stdin;".format(staging_table),
+                _CopySource(lines))
+            result = self.client._fetchall(cursor, """
+            select count(bq_insert(%s, doc)) from {};
+            """.format(staging_table), (self.collection_name,),
+                collection=self.collection_name, prepare=False)
         return result[0][0]
 
     # Update
@@ -310,9 +1888,30 @@ class BedquiltCollection(object):
         assert type(doc) is dict
         result = self._query("""
         select bq_save(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(doc)))
+        """, (self.collection_name, self._dumps(doc)))
+        self.client._invalidate(self.collection_name, [result[0][0]])
         return result[0][0]
 
+    def save_many(self, docs, batch_size=1000):
+        """
+        Save many dicts to collection, with the same semantics as save.
+        Documents are sent to the server in batches, one statement per
+        batch, and all batches are saved within a single transaction.
+        If the same _id appears more than once, the last document wins.
+        Args:
+          - docs: list of dicts representing documents to save.
+          - batch_size: (optional) integer number of documents to send
+            per statement (default 1000).
+        Returns: list of string _id fields of saved documents, in the
+        same order as docs.
+        """
+        assert type(docs) is list
+        for doc in docs:
+            assert type(doc) is dict
+        ids = self._many("bq_save", docs, batch_size)
+        self.client._invalidate(self.collection_name, ids)
+        return ids
+
     # Delete
     def remove(self, query_doc):
         """
@@ -324,7 +1923,8 @@ class BedquiltCollection(object):
         assert type(query_doc) is dict
         result = self._query("""
         select bq_remove(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(query_doc)))
+        """, (self.collection_name, self._dumps(query_doc)))
+        self.client._invalidate(self.collection_name)
         return result[0][0]
 
     def remove_one(self, query_doc):
@@ -338,7 +1938,8 @@ class BedquiltCollection(object):
         assert type(query_doc) is dict
         result = self._query("""
         select bq_remove_one(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(query_doc)))
+        """, (self.collection_name, self._dumps(query_doc)))
+        self.client._invalidate(self.collection_name)
         return result[0][0]
 
     def remove_one_by_id(self, doc_id):
@@ -352,6 +1953,7 @@ class BedquiltCollection(object):
         result = self._query("""
         select bq_remove_one_by_id(%s, %s);
         """, (self.collection_name, doc_id))
+        self.client._invalidate(self.collection_name, [doc_id])
         return result[0][0]
 
     def remove_many_by_ids(self, doc_ids):
@@ -364,7 +1966,8 @@ class BedquiltCollection(object):
         assert type(doc_ids) == list
         result = self._query("""
         select bq_remove_many_by_ids(%s, %s);
-        """, (self.collection_name, json.dumps(doc_ids)))
+        """, (self.collection_name, self._dumps(doc_ids)))
+        self.client._invalidate(self.collection_name, doc_ids)
         return result[0][0]
 
 
@@ -379,9 +1982,70 @@ class BedquiltCollection(object):
         assert type(constraint_spec) is dict
         result = self._query("""
         select bq_add_constraints(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(constraint_spec)))
+        """, (self.collection_name, self._dumps(constraint_spec)))
         return result[0][0]
 
+    def add_invalidation_trigger(self):
+        """
+        Install a trigger on this collection which NOTIFYs clients
+        listening for invalidations (see the `cache_listen` option of
+        BedquiltClient) of every document updated or removed, by any
+        client or process. A statement which changes more than
+        MAX_ROW_INVALIDATIONS documents sends one notification for the
+        whole collection instead of one for each of the rest, so that
+        bulk updates and removes do not flood the listeners. Creates the
+        collection if it does not exist.
+        Returns: None
+        """
+        self.client.create_collection(self.collection_name)
+        table = psycopg2.sql.Identifier(self.collection_name)
+        with self.client._connection() as connection, \
+                _transaction(connection.cursor()) as cursor:
+            cursor.execute("""
+            create or replace function bq_notify_invalidation()
+            returns trigger as $$
+            declare
+                -- documents changed so far by the current statement
+                counter text := 'bq_invalidation.t' || tg_relid;
+                changed integer;
+                doc_id text;
+            begin
+                if tg_level = 'STATEMENT' and tg_when = 'BEFORE' then
+                    perform set_config(counter, '0', true);
+                    return null;
+                end if;
+                if tg_level = 'ROW' then
+                    changed := current_setting(counter)::integer + 1;
+                    perform set_config(counter, changed::text, true);
+                    if changed > tg_argv[0]::integer + 1 then
+                        -- the whole collection is already invalidated
+                        return null;
+                    elsif changed <= tg_argv[0]::integer then
+                        doc_id := old.bq_jdoc->>'_id';
+                    end if;
+                end if;
+                perform pg_notify(%s, json_build_object(
+                    'collection', tg_table_name, '_id', doc_id)::text);
+                return null;
+            end
+            $$ language plpgsql;
+            """, (INVALIDATION_CHANNEL,))
+            cursor.execute(psycopg2.sql.SQL("""
+            drop trigger if exists bq_count_invalidations on {table};
+            drop trigger if exists bq_notify_invalidation on {table};
+            drop trigger if exists bq_notify_truncate on {table};
+            create trigger bq_count_invalidations
+            before update or delete on {table}
+            for each statement execute procedure bq_notify_invalidation();
+            create trigger bq_notify_invalidation
+            after update or delete on {table}
+            for each row execute procedure bq_notify_invalidation({limit});
+            create trigger bq_notify_truncate
+            after truncate on {table}
+            for each statement execute procedure bq_notify_invalidation();
+            """).format(table=table,
+                        limit=psycopg2.sql.Literal(str(MAX_ROW_INVALIDATIONS))))
+
     def list_constraints(self):
         """
         List all constraints on this collection.
@@ -403,11 +2067,803 @@ class BedquiltCollection(object):
         assert type(constraint_spec) is dict
         result = self._query("""
         select bq_remove_constraints(%s, %s::jsonb);
-        """, (self.collection_name, json.dumps(constraint_spec)))
+        """, (self.collection_name, self._dumps(constraint_spec)))
         return result[0][0]
 
+    # Indexes
+    def create_index(self, key_paths=None, kind='btree', unique=False,
+                     where=None, name=None, concurrently=False):
+        """
+        Create an index on this collection, creating the collection if
+        it does not exist.
+        A 'btree' index is built on the values at the key paths, and is
+        used by sorts on them. A 'gin' index is built on whole documents,
+        and is used by queries matching values with plain equality such
+        as {'city': 'London'}.
+        Args:
+          - key_paths: (optional) list of dotted key paths, such as
+            ['address.city'], required for 'btree' indexes, and not
+            allowed for 'gin' indexes.
+          - kind: (optional) 'btree' or 'gin' (default 'btree').
+          - unique: (optional) boolean, require the values at the key
+            paths to be unique (default False, 'btree' only).
+          - where: (optional) dict, a query doc of plain key/value pairs,
+            to require uniqueness only among the documents which contain
+            them ('unique' only). Queries do not use such an index.
+          - name: (optional) string name of the index. Defaults to a
+            name derived from the collection, kind and key paths.
+          - concurrently: (optional) boolean, build the index without
+            locking out writes to the collection, which is slower
+            (default False).
+        Returns: string name of the index.
+        Example:
+          - collection.create_index(['age'])
+          - collection.create_index(kind='gin')
+          - collection.create_index(['email'], unique=True)
+        """
+        if key_paths is None:
+            key_paths = []
+        assert type(key_paths) is list
+        for key_path in key_paths:
+            assert isinstance(key_path, six.string_types) and key_path
+        assert kind in ('btree', 'gin'), "kind must be 'btree' or 'gin'"
+        assert kind == 'gin' or key_paths, "btree indexes need key paths"
+        assert kind == 'btree' or not key_paths, \
+            "gin indexes are built on whole documents, without key paths"
+        assert kind == 'btree' or not unique, "gin indexes cannot be unique"
+        if where is not None:
+            assert unique, "where is only supported for unique indexes"
+            assert type(where) is dict and not _has_operators(where), \
+                "where must be a query doc without operators"
+        if name is None:
+            name = _index_name(self.collection_name, kind, key_paths, where)
+
+        if kind == 'btree':
+            columns = psycopg2.sql.SQL(", ").join(
+                psycopg2.sql.SQL("(bq_jdoc #> {}::text[])").format(
+                    psycopg2.sql.Literal(_text_array(key_path.split('.'))))
+                for key_path in key_paths)
+        else:
+            columns = psycopg2.sql.SQL("bq_jdoc jsonb_path_ops")
+        predicate = psycopg2.sql.SQL("")
+        if where is not None:
+            predicate = psycopg2.sql.SQL(" where bq_jdoc @> {}::jsonb").format(
+                psycopg2.sql.Literal(self._dumps(where)))
+
+        self.client.create_collection(self.collection_name)
+        with self.client._connection() as connection:
+            connection.cursor().execute(psycopg2.sql.SQL("""
+            create {unique}index {concurrently}if not exists {name}
+            on {table} using {kind} ({columns}){predicate};
+            """).format(
+                unique=psycopg2.sql.SQL("unique " if unique else ""),
+                concurrently=psycopg2.sql.SQL(
+                    "concurrently " if concurrently else ""),
+                name=psycopg2.sql.Identifier(name),
+                table=psycopg2.sql.Identifier(self.collection_name),
+                kind=psycopg2.sql.SQL(kind),
+                columns=columns,
+                predicate=predicate))
+        return name
+
+    def list_indexes(self):
+        """
+        List the indexes on this collection, including the index of its
+        primary key.
+        Returns: list of dicts, with the keys 'name' and 'definition'.
+        """
+        result = self._query("""
+        select indexname, indexdef from pg_catalog.pg_indexes
+        where schemaname = current_schema() and tablename = %s
+        order by indexname;
+        """, (self.collection_name,))
+        return [{'name': row[0], 'definition': row[1]} for row in result]
+
+    def drop_index(self, name, concurrently=False):
+        """
+        Drop an index from this collection.
+        Args:
+          - name: string name of the index.
+          - concurrently: (optional) boolean, drop the index without
+            locking out queries on the collection (default False).
+        Returns: boolean, indicating whether the index was dropped.
+        """
+        assert isinstance(name, six.string_types)
+        if name not in [index['name'] for index in self.list_indexes()]:
+            return False
+        with self.client._connection() as connection:
+            connection.cursor().execute(psycopg2.sql.SQL("""
+            drop index {concurrently}if exists {name};
+            """).format(
+                concurrently=psycopg2.sql.SQL(
+                    "concurrently " if concurrently else ""),
+                name=psycopg2.sql.Identifier(name)))
+        return True
+
+
+class PipelineResult(object):
+    """
+    Handle for the result of an operation queued in a BedquiltPipeline,
+    available once the pipeline has been executed.
+    """
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def done(self):
+        """
+        Check whether the operation has been executed.
+        Returns: Boolean
+        """
+        return self._done
+
+    def result(self):
+        """
+        Get the result of the operation, which is the same as the return
+        value of the corresponding BedquiltCollection method.
+        Raises the error of the operation, if it failed.
+        """
+        if not self._done:
+            raise Exception("Pipeline has not been executed yet")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _set_result(self, value):
+        self._value = value
+        self._done = True
+
+    def _set_error(self, error):
+        self._error = error
+        self._done = True
+
+
+class BedquiltPipeline(object):
+
+    def __init__(self, client, transaction=True, batch_size=None):
+        """
+        Create a BedquiltPipeline, which queues operations on any number of
+        collections and sends them to the server in as few round trips as
+        possible when executed.
+        Args:
+          - client: instance of BedquiltClient.
+          - transaction: (optional) boolean, run all operations in a single
+            transaction (default True). Without one, each statement of
+            batch_size operations succeeds or fails on its own, so False
+            requires a batch_size.
+          - batch_size: (optional) integer maximum number of operations to
+            send per statement (default None, all in one statement).
+        Example:
+          - with client.pipeline() as pipeline:
+                one = pipeline['people'].insert({'name': 'Sarah'})
+                two = pipeline['things'].remove_one_by_id('lamp')
+            one.result()
+        """
+        assert transaction or batch_size is not None, \
+            "transaction=False requires a batch_size, as a single " \
+            "statement is always atomic"
+        self.client = client
+        self.transaction = transaction
+        self.batch_size = batch_size
+        self._operations = []
+        # (collection_name, doc_ids) to remove from the client's cache
+        self._invalidations = []
+
+    def collection(self, collection_name):
+        """
+        Get a PipelineCollection object, with which to queue operations.
+        Args:
+          - collection_name: string name of collection.
+        Returns: Instance of PipelineCollection.
+        """
+        return PipelineCollection(self, collection_name)
+
+    def __getitem__(self, collection_name):
+        return self.collection(collection_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self._operations = []
+            self._invalidations = []
+
+    def _queue(self, expression, params):
+        result = PipelineResult()
+        self._operations.append((expression, params, result))
+        return result
+
+    def _invalidate(self, collection_name, doc_ids=None):
+        self._invalidations.append((collection_name, doc_ids))
+
+    def execute(self):
+        """
+        Send all queued operations to the server.
+        Returns: list of the results of the operations, in the order
+        they were queued.
+        """
+        operations, self._operations = self._operations, []
+        invalidations, self._invalidations = self._invalidations, []
+        if not operations:
+            return []
+        batches = _batches(operations, self.batch_size or len(operations))
+        try:
+            with self.client._connection() as connection:
+                cursor = connection.cursor()
+                if self.transaction and len(batches) > 1:
+                    with _transaction(cursor):
+                        for batch in batches:
+                            self._execute_batch(cursor, batch)
+                else:
+                    for batch in batches:
+                        self._execute_batch(cursor, batch)
+        except Exception as e:
+            for _, _, result in operations:
+                if self.transaction or not result.done():
+                    result._set_error(e)
+            raise
+        finally:
+            for collection_name, doc_ids in invalidations:
+                self.client._invalidate(collection_name, doc_ids)
+        return [result.result() for _, _, result in operations]
+
+    def _execute_batch(self, cursor, batch):
+        # a union of one-row selects, which the server runs in order
+        query_string = "\nunion all\n".join(
+            "select {}, {}".format(n, expression)
+            for n, (expression, _, _) in enumerate(batch))
+        params = tuple(param for _, params, _ in batch for param in params)
+        for n, value in self.client._fetchall(
+                cursor, query_string, params, operation='pipeline',
+                prepare=False):
+            batch[n][2]._set_result(value)
+
+
+class PipelineCollection(object):
+
+    def __init__(self, pipeline, collection_name):
+        """
+        Create a PipelineCollection object, with methods which queue
+        operations on a BedquiltPipeline and return a PipelineResult.
+        Args:
+          - pipeline: instance of BedquiltPipeline.
+          - collection_name: string name of collection.
+        """
+        self.pipeline = pipeline
+        self.collection_name = collection_name
+        self._dumps = pipeline.client.json_codec.dumps
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pipeline.__exit__(exc_type, exc_value, traceback)
+
+    def execute(self):
+        """
+        Send all operations queued on the pipeline to the server.
+        Returns: list of the results of the operations.
+        """
+        return self.pipeline.execute()
+
+    def find_one(self, query_doc=None, skip=0, sort=None):
+        """
+        Queue a find_one operation.
+        Returns: PipelineResult
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+
+        if sort is not None:
+            assert type(sort) is list
+            sort = self._dumps(sort)
+
+        return self.pipeline._queue(
+            "(select bq_find_one(%s, %s::jsonb, %s, %s::jsonb))",
+            (self.collection_name, self._dumps(query_doc), skip, sort))
+
+    def find_one_by_id(self, doc_id):
+        """
+        Queue a find_one_by_id operation.
+        Returns: PipelineResult
+        """
+        assert isinstance(doc_id, six.string_types)
+        return self.pipeline._queue(
+            "(select bq_find_one_by_id(%s, %s))",
+            (self.collection_name, doc_id))
+
+    def count(self, query_doc=None):
+        """
+        Queue a count operation.
+        Returns: PipelineResult
+        """
+        if query_doc is None:
+            query_doc = {}
+        assert type(query_doc) is dict
+        return self.pipeline._queue(
+            "to_jsonb(bq_count(%s, %s))",
+            (self.collection_name, self._dumps(query_doc)))
+
+    def insert(self, doc):
+        """
+        Queue an insert operation.
+        Returns: PipelineResult
+        """
+        assert type(doc) is dict
+        return self.pipeline._queue(
+            "to_jsonb(bq_insert(%s, %s::jsonb))",
+            (self.collection_name, self._dumps(doc)))
+
+    def save(self, doc):
+        """
+        Queue a save operation.
+        Returns: PipelineResult
+        """
+        assert type(doc) is dict
+        if '_id' in doc:
+            self.pipeline._invalidate(self.collection_name, [doc['_id']])
+        return self.pipeline._queue(
+            "to_jsonb(bq_save(%s, %s::jsonb))",
+            (self.collection_name, self._dumps(doc)))
+
+    def remove(self, query_doc):
+        """
+        Queue a remove operation.
+        Returns: PipelineResult
+        """
+        assert type(query_doc) is dict
+        self.pipeline._invalidate(self.collection_name)
+        return self.pipeline._queue(
+            "to_jsonb(bq_remove(%s, %s::jsonb))",
+            (self.collection_name, self._dumps(query_doc)))
+
+    def remove_one(self, query_doc):
+        """
+        Queue a remove_one operation.
+        Returns: PipelineResult
+        """
+        assert type(query_doc) is dict
+        self.pipeline._invalidate(self.collection_name)
+        return self.pipeline._queue(
+            "to_jsonb(bq_remove_one(%s, %s::jsonb))",
+            (self.collection_name, self._dumps(query_doc)))
+
+    def remove_one_by_id(self, doc_id):
+        """
+        Queue a remove_one_by_id operation.
+        Returns: PipelineResult
+        """
+        assert isinstance(doc_id, six.string_types)
+        self.pipeline._invalidate(self.collection_name, [doc_id])
+        return self.pipeline._queue(
+            "to_jsonb(bq_remove_one_by_id(%s, %s))",
+            (self.collection_name, doc_id))
+
+    def remove_many_by_ids(self, doc_ids):
+        """
+        Queue a remove_many_by_ids operation.
+        Returns: PipelineResult
+        """
+        assert type(doc_ids) == list
+        self.pipeline._invalidate(self.collection_name, doc_ids)
+        return self.pipeline._queue(
+            "to_jsonb(bq_remove_many_by_ids(%s, %s))",
+            (self.collection_name, self._dumps(doc_ids)))
+
+
 # Helpers
 def _unpack_row(json_row):
     if len(json_row) != 1:
         raise Exception("something wrong with row: {}".format(json_row))
     return json_row[0]
+
+
+def _unpack_rows(json_rows):
+    if json_rows and len(json_rows[0]) != 1:
+        raise Exception("something wrong with row: {}".format(json_rows[0]))
+    return [row[0] for row in json_rows]
+
+
+def _batches(docs, batch_size):
+    return [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
+
+
+def _many_query(function_name):
+    """
+    Build a statement applying a bq_* function to each element of a
+    jsonb array of documents, returning the results in array order.
+    """
+    return """
+    select {}(%s, d.doc)
+    from jsonb_array_elements(%s::jsonb) with ordinality as d(doc, n)
+    order by d.n;
+    """.format(function_name)
+
+
+def _project(function_call, projection):
+    """
+    Build a query selecting the results of a set-returning bq_* function
+    call, optionally projecting each document to a list of key paths.
+    Returns: tuple of (query string, tuple of params for the projection)
+    """
+    if projection is None:
+        return "select {};".format(function_call.strip()), tuple()
+    assert type(projection) is list
+    tree = collections.OrderedDict()
+    for key_path in ['_id'] + projection:
+        assert isinstance(key_path, six.string_types)
+        node = tree
+        keys = key_path.split('.')
+        for key in keys[:-1]:
+            node = node.setdefault(key, collections.OrderedDict())
+            if node is True:
+                # the whole parent value is already selected
+                break
+        else:
+            node[keys[-1]] = True
+    expression, params = _projection_expression(tree, [])
+    return "select {} from {} as t(doc);".format(
+        expression, function_call.strip()), tuple(params)
+
+
+def _projection_expression(tree, parent_keys):
+    """
+    Build a jsonb expression selecting the key paths in tree from `doc`.
+    Keys which are missing from the document are left out, and nested
+    objects which end up empty are left out of their parent.
+    """
+    values = []
+    params = []
+    for key, node in tree.items():
+        keys = parent_keys + [key]
+        if node is True:
+            values.append("(%s::text, doc #> %s)")
+            params.extend([key, keys])
+        else:
+            expression, node_params = _projection_expression(node, keys)
+            values.append("(%s::text, nullif({}, '{{}}'::jsonb))".format(
+                expression))
+            params.extend([key] + node_params)
+    expression = (
+        "(select coalesce(jsonb_object_agg(p.k, p.v), '{{}}'::jsonb) "
+        "from (values {}) as p(k, v) where p.v is not null)").format(
+            ", ".join(values))
+    return expression, params
+
+
+def _checked_docs(docs):
+    for doc in docs:
+        assert type(doc) is dict
+        yield doc
+
+
+def _json_lines(source):
+    for line in source:
+        if isinstance(line, six.binary_type):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            yield line
+
+
+class _CopySource(object):
+    """
+    File-like object for copy_expert, producing one json document per line
+    in COPY text format, pulling documents from an iterator as it is read.
+    """
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._pending = ''
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunk = _copy_escape(line) + '\n'
+            chunks.append(chunk)
+            length += len(chunk)
+        data = ''.join(chunks)
+        if size < 0:
+            self._pending = ''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def _copy_escape(text):
+    return (text.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\r', '\\r')
+            .replace('\n', '\\n'))
+
+
+def _cursor_name():
+    return 'bq_cursor_{}'.format(uuid.uuid4().hex)
+
+
+def _run_in_threads(functions, on_error=None):
+    """
+    Call each of functions in its own thread.
+    Returns: list of their results, in order. If any of them raises,
+    on_error is called with each of the other results, then the first
+    exception is raised.
+    """
+    results = [None] * len(functions)
+    errors = []
+
+    def run(n):
+        try:
+            results[n] = functions[n]()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(n,))
+               for n in range(len(functions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        if on_error is not None:
+            for result in results:
+                if result is not None:
+                    on_error(result)
+        raise errors[0]
+    return results
+
+
+def _merge_cursors(cursors):
+    """
+    Iterate over the documents of several cursors, each read by its own
+    thread, in the order they arrive.
+    """
+    batches = queue.Queue(maxsize=2 * len(cursors))
+    stopping = threading.Event()
+    done = object()
+
+    def read(cursor):
+        try:
+            with cursor:
+                for batch in cursor.iter_batches():
+                    batches.put(batch)
+                    if stopping.is_set():
+                        return
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(done)
+
+    for cursor in cursors:
+        thread = threading.Thread(target=read, args=(cursor,))
+        thread.daemon = True
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < len(cursors):
+            batch = batches.get()
+            if batch is done:
+                finished += 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                for doc in batch:
+                    yield doc
+    finally:
+        # let the readers finish, so their connections are released
+        stopping.set()
+        while finished < len(cursors):
+            if batches.get() is done:
+                finished += 1
+
+
+def _operation_name(query_string):
+    match = re.search(r'\bbq_\w+', query_string)
+    if match is None:
+        return None
+    return match.group(0)
+
+
+def _operation_args(event, operations):
+    """
+    Get the arguments of the bq_* function of an event, by name.
+    Returns: dict, empty for operations not in operations.
+    """
+    names = operations.get(event.operation)
+    if names is None or event.params is None:
+        return {}
+    # parameters of the query before the function's own, if any
+    offset = event.query[:event.query.find(event.operation + '(')] \
+        .count('%s')
+    args = dict(zip(names, event.params[offset:offset + len(names)]))
+    for name in ('query_doc', 'sort', 'doc_ids'):
+        if isinstance(args.get(name), six.string_types):
+            args[name] = json.loads(args[name])
+    return args
+
+
+def _capture_plans(cursor, query_string, params=None, analyze=True):
+    """
+    Run a query with the auto_explain module logging the plans of it and
+    of every statement it runs in turn, such as the queries of the bq_*
+    functions, then roll back. The query is executed, whether or not
+    analyze is set, so any writes it makes happen before the rollback.
+    Returns: list of plans, as dicts, in the order the statements
+    finished: the statements run by the query first, then the query.
+    """
+    connection = cursor.connection
+    cursor.execute("begin;")
+    try:
+        cursor.execute("load 'auto_explain';")
+        cursor.execute("""
+        set local auto_explain.log_min_duration = 0;
+        set local auto_explain.log_analyze = %s;
+        set local auto_explain.log_buffers = %s;
+        set local auto_explain.log_nested_statements = on;
+        set local auto_explain.log_format = json;
+        set local auto_explain.log_level = notice;
+        """, (analyze, analyze))
+        del connection.notices[:]
+        cursor.execute(query_string, params)
+        cursor.fetchall()
+        notices = list(connection.notices)
+    finally:
+        cursor.execute("rollback;")
+    plans = []
+    for notice in notices:
+        position = notice.find('plan:')
+        if position >= 0:
+            plans.append(json.loads(notice[position + len('plan:'):]))
+    return plans
+
+
+def _plan_scans(plans, table_name):
+    """
+    Find the scans of a table in query plans.
+    Returns: list with the name of the index of each index scan of the
+    table, and None for each sequential scan.
+    """
+    scans = []
+
+    def visit(node, parent_relation):
+        relation = node.get('Relation Name', parent_relation)
+        node_type = node.get('Node Type')
+        if relation == table_name:
+            if node_type == 'Seq Scan':
+                scans.append(None)
+            elif 'Index Name' in node:
+                scans.append(node['Index Name'])
+        for child in node.get('Plans', []):
+            # a bitmap index scan is a child of the heap scan it feeds
+            visit(child, relation if node_type in (
+                'Bitmap Heap Scan', 'BitmapAnd', 'BitmapOr') else None)
+
+    for plan in plans:
+        visit(plan['Plan'], None)
+    return scans
+
+
+def _has_operators(query_doc):
+    for key, value in query_doc.items():
+        if key.startswith('$'):
+            return True
+        if type(value) is dict and _has_operators(value):
+            return True
+    return False
+
+
+def _text_array(values):
+    """
+    Build a postgres text array literal, such as '{"address","city"}'.
+    """
+    return '{{{}}}'.format(','.join(
+        '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+        for value in values))
+
+
+def _index_name(collection_name, kind, key_paths, where):
+    """
+    Build a default index name, within the 63 characters postgres allows,
+    which differs for different key paths and where docs.
+    """
+    digest = hashlib.md5(json.dumps(
+        [kind, key_paths, where], sort_keys=True).encode('utf-8')) \
+        .hexdigest()[:8]
+    stem = '_'.join([collection_name, kind] + key_paths)
+    stem = re.sub(r'[^A-Za-z0-9_]', '_', stem)[:50]
+    return '{}_{}'.format(stem, digest)
+
+
+def _notify(callback, event):
+    try:
+        callback(event)
+    except Exception:
+        logger.exception("Error in operation listener")
+
+
+def _decode_chunk(loads, chunk):
+    return [loads(doc) for doc in chunk]
+
+
+def _key_path_value(doc, key_path):
+    """
+    Get the value at a dotted key path, such as 'address.city' or
+    'addresses.0.city', of a document.
+    """
+    value = doc
+    for key in key_path.split('.'):
+        if isinstance(value, list):
+            value = value[int(key)]
+        else:
+            value = value[key]
+    return value
+
+
+def _page_token(values):
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _parse_page_token(token, sort_keys):
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise Exception("Invalid continuation token")
+    if type(values) is not list or len(values) != len(sort_keys):
+        raise Exception("Continuation token does not match sort")
+    return values
+
+
+def _page_branches(query_doc, sort_keys, values):
+    """
+    Build the query docs which together match the documents after the
+    given sort key values, in sort order: those equal on every key but
+    the last and after it on the last, then those equal on every key but
+    the last two and after it on the second to last, and so on.
+    """
+    branches = []
+    for level in range(len(sort_keys), 0, -1):
+        branch_doc = copy.deepcopy(query_doc)
+        conditions = [(key_path, '$eq', value) for (key_path, _), value
+                      in zip(sort_keys[:level - 1], values)]
+        key_path, direction = sort_keys[level - 1]
+        conditions.append(
+            (key_path, '$gt' if direction >= 0 else '$lt', values[level - 1]))
+        if all(_add_condition(branch_doc, key_path, operator, value)
+               for key_path, operator, value in conditions):
+            branches.append(branch_doc)
+    return branches
+
+
+def _add_condition(query_doc, key_path, operator, value):
+    """
+    Add {operator: value} at the dotted key path of query_doc,
+    alongside any condition already there, unless it is the same.
+    Returns: False if the query already requires a value at the key path,
+    which the condition could never match, otherwise True.
+    """
+    keys = key_path.split('.')
+    for key in keys[:-1]:
+        query_doc = query_doc.setdefault(key, {})
+    existing = query_doc.get(keys[-1])
+    if existing is None:
+        query_doc[keys[-1]] = {operator: value}
+    elif type(existing) is dict and all(
+            key.startswith('$') for key in existing):
+        if existing.get(operator, value) != value:
+            raise Exception("Cannot paginate on {}, which the query "
+                            "already tests with {}".format(key_path, operator))
+        existing[operator] = value
+    else:
+        # an exact value, which a document on the page already had
+        return operator == '$eq'
+    return True
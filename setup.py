@@ -78,6 +78,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'async': ['aiopg'],
     },
 
     # If there are data files included in your packages that need to be
@@ -0,0 +1,180 @@
+"""
+Tests of pybedquilt.aio, which use syntax that only parses on python 3.6+,
+so are loaded by test_async_client on those versions.
+"""
+import testutils
+import unittest
+import asyncio
+import gc
+import json
+import warnings
+import psycopg2
+
+try:
+    from pybedquilt.aio import \
+        AsyncBedquiltClient, \
+        AsyncBedquiltCollection, \
+        AsyncBedquiltCursor
+except ImportError:
+    AsyncBedquiltClient = None
+
+
+@unittest.skipIf(AsyncBedquiltClient is None, "aiopg is not installed")
+class TestAsyncBedquiltClient(testutils.BedquiltTestCase):
+
+    def setUp(self):
+        super(TestAsyncBedquiltClient, self).setUp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super(TestAsyncBedquiltClient, self).tearDown()
+
+    def _run(self, test):
+        async def run():
+            client = AsyncBedquiltClient(
+                'dbname={}'.format(self.database_name), pool_size=4)
+            try:
+                await test(client)
+            finally:
+                await client.close()
+        self.loop.run_until_complete(run())
+
+    def test_collections(self):
+        async def test(client):
+            self.assertEqual(await client.list_collections(), [])
+            self.assertTrue(await client.create_collection('things'))
+            self.assertTrue(await client.collection_exists('things'))
+            self.assertEqual(await client.list_collections(), ['things'])
+            self.assertIsInstance(client['things'], AsyncBedquiltCollection)
+            self.assertTrue(await client.delete_collection('things'))
+        self._run(test)
+
+    def test_insert_and_find(self):
+        async def test(client):
+            coll = client['people']
+            sarah = {'_id': 'sarah@example.com', 'name': 'Sarah', 'age': 34}
+            mike = {'_id': 'mike@example.com', 'name': 'Mike', 'age': 32}
+
+            self.assertEqual(await coll.insert(sarah), 'sarah@example.com')
+            self.assertEqual(await coll.insert(mike), 'mike@example.com')
+
+            with self.assertRaises(psycopg2.IntegrityError):
+                await coll.insert(sarah)
+
+            self.assertEqual(await coll.find_one({'name': 'Mike'}), mike)
+            self.assertEqual(
+                await coll.find_one_by_id('sarah@example.com'), sarah)
+            self.assertIsNone(await coll.find_one_by_id('wat'))
+            self.assertEqual(await coll.count(), 2)
+            self.assertEqual(await coll.count({'age': 34}), 1)
+
+            result = coll.find(sort=[{'age': 1}])
+            self.assertIsInstance(result, AsyncBedquiltCursor)
+            self.assertEqual([doc async for doc in result], [mike, sarah])
+
+            result = coll.find_many_by_ids(['sarah@example.com', 'wat'])
+            self.assertEqual(await result.to_list(), [sarah])
+
+            result = await coll.find_one_by_id('mike@example.com', raw=True)
+            self.assertEqual(json.loads(result), mike)
+            result = coll.find({'name': 'Sarah'}, raw=True)
+            self.assertEqual(list(map(json.loads, await result.to_list())),
+                             [sarah])
+
+            result = coll.distinct('age', stream=False)
+            self.assertEqual(sorted(await result.to_list()), [32, 34])
+        self._run(test)
+
+    def test_streaming_cursor(self):
+        async def test(client):
+            coll = client['things']
+            ids = await coll.insert_many(
+                [{'n': x} for x in range(25)], batch_size=10)
+            self.assertEqual(len(ids), 25)
+
+            result = coll.find(sort=[{'n': 1}], stream=True, batch_size=10)
+            batches = []
+            batch = await result.next_batch()
+            while batch:
+                batches.append(batch)
+                batch = await result.next_batch()
+            self.assertEqual(list(map(len, batches)), [10, 10, 5])
+            self.assertTrue(result.closed)
+
+            async with coll.find(stream=True) as result:
+                self.assertEqual((await result.__anext__())['n'], 0)
+            self.assertTrue(result.closed)
+
+            # connection was returned to the pool
+            self.assertEqual(await coll.count(), 25)
+        self._run(test)
+
+    def test_client_created_outside_the_loop(self):
+        client = AsyncBedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=2)
+
+        async def test():
+            try:
+                self.assertEqual(await client['things'].count(), 0)
+            finally:
+                await client.close()
+        self.loop.run_until_complete(test())
+
+    def test_streaming_cursor_left_early(self):
+        async def test(client):
+            coll = client['things']
+            await coll.insert_many([{'n': x} for x in range(25)])
+            pool = client.pool
+
+            result = coll.find(stream=True)
+            result.batch_size = 5
+            async with result:
+                async for doc in result:
+                    break
+            self.assertTrue(result.closed)
+            self.assertEqual(pool.size - pool.freesize, 0)
+
+            # a cursor which is never closed warns, and is released
+            result = coll.find(stream=True)
+            result.batch_size = 5
+            await result.__anext__()
+            self.assertEqual(pool.size - pool.freesize, 1)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                del result
+                gc.collect()
+            self.assertTrue(any(issubclass(w.category, ResourceWarning)
+                                for w in caught))
+            await asyncio.sleep(0.1)
+            self.assertEqual(pool.size - pool.freesize, 0)
+            self.assertEqual(await coll.count(), 25)
+        self._run(test)
+
+    def test_save_and_remove(self):
+        async def test(client):
+            coll = client['things']
+            await coll.save({'_id': 'a', 'n': 1})
+            await coll.save({'_id': 'a', 'n': 2})
+            await coll.save_many([{'_id': 'b', 'n': 3}, {'_id': 'c', 'n': 4}])
+            self.assertEqual(await coll.find_one_by_id('a'),
+                             {'_id': 'a', 'n': 2})
+
+            self.assertEqual(await coll.remove_one_by_id('a'), 1)
+            self.assertEqual(await coll.remove_many_by_ids(['b']), 1)
+            self.assertEqual(await coll.remove_one({'n': 4}), 1)
+            self.assertEqual(await coll.remove({}), 0)
+        self._run(test)
+
+    def test_constraints(self):
+        async def test(client):
+            coll = client['people']
+            self.assertTrue(
+                await coll.add_constraints({'name': {'$required': 1}}))
+            self.assertEqual(await coll.list_constraints(),
+                             ['name:required'])
+            with self.assertRaises(psycopg2.IntegrityError):
+                await coll.insert({'age': 20})
+            self.assertTrue(
+                await coll.remove_constraints({'name': {'$required': 1}}))
+        self._run(test)
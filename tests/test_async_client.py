@@ -0,0 +1,10 @@
+import sys
+
+
+def load_tests(loader, tests, pattern):
+    # the tests of pybedquilt.aio use async syntax, which python 2 and
+    # python 3.5 cannot parse, so they are only imported on python 3.6+
+    if sys.version_info >= (3, 6):
+        import async_client_tests
+        tests.addTests(loader.loadTestsFromModule(async_client_tests))
+    return tests
@@ -1,6 +1,9 @@
 import pybedquilt
 import testutils
 import psycopg2
+import psycopg2.pool
+import threading
+import json
 
 
 class TestBedquiltClient(testutils.BedquiltTestCase):
@@ -117,3 +120,279 @@ class TestBedquiltClient(testutils.BedquiltTestCase):
 
         result = client.collection_exists('things')
         self.assertFalse(result)
+
+    def test_create_client_with_pool(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=2)
+
+        self.assertIsNotNone(client)
+        self.assertIsNone(client.connection)
+        self.assertIsNotNone(client.pool)
+
+        client.create_collection('things')
+        self.assertEqual(client.list_collections(), ['things'])
+        client.close()
+
+    def test_pooled_cursors_return_connections(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=2)
+        coll = client['things']
+        coll.insert_many([{'n': x} for x in range(10)])
+
+        # exhausted cursor
+        result = coll.find(stream=True)
+        self.assertEqual(len(client.pool._used), 1)
+        self.assertEqual(len(list(result)), 10)
+        self.assertEqual(len(client.pool._used), 0)
+
+        # closed cursor
+        result = coll.find(stream=True)
+        next(result)
+        result.close()
+        self.assertEqual(len(client.pool._used), 0)
+
+        # cursor used as a context manager
+        with coll.distinct('n', stream=True) as result:
+            self.assertEqual(len(client.pool._used), 1)
+        self.assertEqual(len(client.pool._used), 0)
+
+        # buffered cursors return their connection once executed
+        result = coll.find()
+        self.assertEqual(len(client.pool._used), 0)
+        self.assertEqual(len(list(result)), 10)
+        client.close()
+
+    def test_pooled_client_with_one_connection(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=1,
+            pool_timeout=0.1)
+        coll = client['things']
+        coll.insert_many([{'_id': 'thing{}'.format(x)} for x in range(10)])
+
+        # several buffered cursors, and operations while iterating them
+        one, two = coll.find(), coll.find()
+        for doc in one:
+            self.assertEqual(coll.find_one_by_id(doc['_id']), doc)
+        self.assertEqual(len(list(two)), 10)
+
+        # a streaming cursor holds the only connection until it is closed
+        with coll.find(stream=True) as result:
+            next(result)
+            with self.assertRaises(psycopg2.pool.PoolError):
+                coll.find_one_by_id('thing1')
+        self.assertEqual(coll.find_one_by_id('thing1'), {'_id': 'thing1'})
+        client.close()
+
+    def test_pooled_client_from_many_threads(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=3)
+        client.create_collection('things')
+        coll = client['things']
+        errors = []
+
+        def work(n):
+            try:
+                for x in range(20):
+                    doc_id = coll.insert({'thread': n, 'x': x})
+                    self.assertEqual(coll.find_one_by_id(doc_id)['x'], x)
+                self.assertEqual(len(list(coll.find({'thread': n}))), 20)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(coll.count(), 160)
+        client.close()
+
+    def test_create_client_with_json_codec(self):
+        calls = {'dumps': 0, 'loads': 0}
+
+        def dumps(value):
+            calls['dumps'] += 1
+            return json.dumps(value)
+
+        def loads(value):
+            calls['loads'] += 1
+            return json.loads(value)
+
+        for pool_size in [None, 2]:
+            calls['dumps'], calls['loads'] = 0, 0
+            client = pybedquilt.BedquiltClient(
+                'dbname={}'.format(self.database_name),
+                pool_size=pool_size,
+                json_codec=pybedquilt.JSONCodec(dumps, loads))
+            coll = client['things']
+
+            doc = {'_id': 'a', 'n': 1, 'name': u'\xe9clair', 'tags': [2.5, None]}
+            coll.save(doc)
+            self.assertTrue(calls['dumps'] > 0)
+            self.assertEqual(coll.find_one_by_id('a'), doc)
+            self.assertTrue(calls['loads'] > 0)
+
+            # documents written and read by the codec round-trip unchanged
+            dumps_calls, loads_calls = calls['dumps'], calls['loads']
+            self.assertEqual(list(coll.find({'n': 1})), [doc])
+            self.assertTrue(calls['dumps'] > dumps_calls)
+            self.assertTrue(calls['loads'] > loads_calls)
+            coll.remove({})
+            client.close()
+
+    def test_create_client_with_auto_json_codec(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), json_codec='auto')
+        self.assertIsInstance(client.json_codec, pybedquilt.JSONCodec)
+
+        coll = client['things']
+        doc = {'_id': 'a', 'name': u'\xe9clair', 'tags': [1, 2.5, None]}
+        coll.save(doc)
+        self.assertEqual(coll.find_one_by_id('a'), doc)
+
+        # modules with dumps and loads functions can be used directly
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), json_codec=json)
+        self.assertEqual(client['things'].find_one_by_id('a'), doc)
+
+    def test_create_client_with_prepared_statements(self):
+        for pool_size in [None, 2]:
+            client = pybedquilt.BedquiltClient(
+                'dbname={}'.format(self.database_name),
+                pool_size=pool_size, prepare=True)
+            coll = client['things']
+
+            for x in range(5):
+                coll.insert({'_id': 'thing{}'.format(x), 'n': x})
+                self.assertEqual(coll.find_one_by_id('thing{}'.format(x)),
+                                 {'_id': 'thing{}'.format(x), 'n': x})
+            self.assertEqual(coll.count(), 5)
+            self.assertEqual(len(list(coll.find({'n': {'$gt': 2}}))), 2)
+            self.assertEqual(coll.find_one({'n': 3}, projection=[]),
+                             {'_id': 'thing3'})
+
+            with client._connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                select count(*) from pg_prepared_statements
+                where name like 'bq\\_%';
+                """)
+                self.assertTrue(cursor.fetchall()[0][0] > 0)
+
+                # statements are prepared again if the server drops them
+                cursor.execute("deallocate all;")
+            self.assertEqual(coll.find_one_by_id('thing1'),
+                             {'_id': 'thing1', 'n': 1})
+            self.assertEqual(coll.remove({}), 5)
+            client.close()
+
+    def test_prepared_statements_shared_connection(self):
+        conn = psycopg2.connect('dbname={}'.format(self.database_name))
+        one = pybedquilt.BedquiltClient(connection=conn, prepare=True)
+        two = pybedquilt.BedquiltClient(connection=conn, prepare=True)
+
+        one['things'].insert({'_id': 'a'})
+        self.assertEqual(one['things'].count(), 1)
+        self.assertEqual(two['things'].count(), 1)
+        conn.close()
+
+    def test_prepared_statements_are_deallocated_beyond_limit(self):
+        limit = pybedquilt.core.MAX_PREPARED_STATEMENTS
+        pybedquilt.core.MAX_PREPARED_STATEMENTS = 2
+        try:
+            client = pybedquilt.BedquiltClient(
+                'dbname={}'.format(self.database_name), prepare=True)
+            coll = client['things']
+            cursor = client.connection.cursor()
+
+            def prepared_count():
+                cursor.execute("""
+                select count(*) from pg_prepared_statements
+                where name like 'bq\\_%';
+                """)
+                return cursor.fetchall()[0][0]
+
+            coll.insert({'_id': 'a', 'n': 1})
+            self.assertEqual(coll.count({'n': 1}), 1)
+            self.assertEqual(prepared_count(), 2)
+            self.assertEqual(coll.find_one_by_id('a'), {'_id': 'a', 'n': 1})
+            self.assertEqual(prepared_count(), 2)
+
+            # the evicted insert is prepared again
+            coll.insert({'_id': 'b', 'n': 1})
+            self.assertEqual(coll.count({'n': 1}), 2)
+            self.assertEqual(prepared_count(), 2)
+            client.close()
+        finally:
+            pybedquilt.core.MAX_PREPARED_STATEMENTS = limit
+
+    def test_prepared_statements_unescape_percent_signs(self):
+        self.assertEqual(
+            pybedquilt.core._prepared_statement(
+                "select %s %% 3, '%%s', %s;")[1],
+            "select $1 % 3, '%s', $2")
+
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), prepare=True)
+        for _ in range(2):
+            self.assertEqual(client._query("""
+            select %s::int %% 3;
+            """, (7,)), [(1,)])
+        client.close()
+
+    def test_generated_statements_are_not_prepared(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), prepare=True)
+        coll = client['things']
+
+        for x in range(3):
+            coll.load([{'n': x}, {'n': x + 1}])
+        coll.insert_many([{'n': x} for x in range(10)], batch_size=3)
+        with client.pipeline(transaction=False, batch_size=2) as pipeline:
+            for x in range(5):
+                pipeline['things'].insert({'n': x})
+        self.assertEqual(coll.count(), 21)
+
+        cursor = client.connection.cursor()
+        cursor.execute("""
+        select statement from pg_prepared_statements
+        where name like 'bq\\_%';
+        """)
+        statements = [row[0] for row in cursor.fetchall()]
+        # only the count, run outside of a transaction, was prepared
+        self.assertEqual(len(statements), 1)
+        self.assertIn('bq_count', statements[0])
+        client.close()
+
+    def test_bootstrap_is_cached_per_server(self):
+        pybedquilt.core._BOOTSTRAPPED.clear()
+        client = self._get_test_client()
+        self.assertIn(client.connection.dsn, pybedquilt.core._BOOTSTRAPPED)
+
+        # a cached bootstrap still allows a client to be created
+        other = self._get_test_client()
+        self.assertEqual(other.list_collections(), [])
+
+    def test_create_lazy_client(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), lazy=True)
+        self.assertIsNone(client._conn)
+
+        client['people'].insert({'_id': 'sarah@example.com'})
+        self.assertIsNotNone(client._conn)
+        self.assertEqual(client['people'].count(), 1)
+
+        # closing a client which never connected does nothing
+        pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), lazy=True).close()
+
+    def test_create_lazy_client_with_pool(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=2, lazy=True)
+        self.assertIsNone(client._pool)
+
+        self.assertEqual(client.list_collections(), [])
+        self.assertIsNotNone(client.pool)
@@ -0,0 +1,61 @@
+import testutils
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestBenchmarkSuite(testutils.BedquiltTestCase):
+
+    def setUp(self):
+        super(TestBenchmarkSuite, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestBenchmarkSuite, self).tearDown()
+
+    def _run_suite(self, *args):
+        env = dict(os.environ,
+                   PYTHONPATH=ROOT,
+                   BEDQUILT_BENCH_DSN='dbname={}'.format(self.database_name))
+        return subprocess.call(
+            [sys.executable, os.path.join(ROOT, 'benchmarks', 'suite.py'),
+             '--iterations', '5', '--seed-count', '20'] + list(args),
+            cwd=ROOT, env=env)
+
+    def test_suite_runs_every_case_against_the_server(self):
+        output = os.path.join(self.directory, 'latest.json')
+        baseline = os.path.join(self.directory, 'baseline.json')
+
+        self.assertEqual(
+            self._run_suite('--output', output, '--save-baseline', baseline),
+            0)
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(sorted(results['results'].keys()), sorted([
+            'insert', 'save', 'find_small', 'find_large', 'find_one_by_id',
+            'count', 'distinct', 'remove_many_by_ids',
+            'insert_with_constraints']))
+        for stats in results['results'].values():
+            self.assertTrue(stats['ops_per_sec'] > 0)
+            self.assertTrue(stats['p50_ms'] <= stats['p95_ms'])
+
+        # compared against a baseline, with room for any noise
+        self.assertEqual(
+            self._run_suite('--only', 'count', '--output', output,
+                            '--baseline', baseline, '--tolerance', '1000'),
+            0)
+
+    def test_suite_fails_without_a_baseline(self):
+        self.assertEqual(
+            self._run_suite('--only', 'count',
+                            '--output', os.path.join(self.directory, 'a.json'),
+                            '--baseline', os.path.join(self.directory,
+                                                       'missing.json')),
+            1)
@@ -62,3 +62,14 @@ class TestCollectionDistinct(testutils.BedquiltTestCase):
             sorted(list(result)),
             sorted(['London', 'Edinburgh', 'Manchester'])
         )
+
+    def test_distinct_with_stream(self):
+        client = self._get_test_client()
+
+        coll = client.collection('things')
+
+        for x in range(20):
+            coll.insert({'n': x % 4})
+
+        result = coll.distinct('n', stream=True)
+        self.assertEqual(sorted(list(result)), [0, 1, 2, 3])
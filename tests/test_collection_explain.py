@@ -0,0 +1,55 @@
+import testutils
+import psycopg2
+
+
+class TestExplain(testutils.BedquiltTestCase):
+
+    def setUp(self):
+        super(TestExplain, self).setUp()
+        client = self._get_test_client()
+        self.coll = client['people']
+        self.coll.insert_many([{'_id': 'user{}'.format(x), 'age': x % 50,
+                                'city': 'London' if x % 2 else 'Paris'}
+                               for x in range(200)])
+        try:
+            self.coll.explain_count()
+        except psycopg2.Error:
+            self.skipTest("auto_explain is not available")
+
+    def test_explain_find(self):
+        result = self.coll.explain({'city': 'London'}, sort=[{'age': 1}],
+                                   skip=2, limit=10)
+
+        self.assertGreater(len(result['plans']), 0)
+        self.assertTrue(any('people' in plan['Query Text']
+                            for plan in result['plans']))
+        self.assertTrue(result['seq_scan'])
+        self.assertFalse(result['index_used'])
+        self.assertEqual(result['indexes'], [])
+        # without analyze, there are no actual row counts
+        self.assertNotIn('Actual Rows', result['plans'][0]['Plan'])
+
+    def test_explain_analyze(self):
+        result = self.coll.explain({'city': 'London'}, analyze=True)
+
+        self.assertTrue(any('Actual Rows' in plan['Plan']
+                            for plan in result['plans']))
+
+    def test_explain_count_and_distinct(self):
+        for result in [self.coll.explain_count({'age': 3}),
+                       self.coll.explain_distinct('city')]:
+            self.assertGreater(len(result['plans']), 0)
+            self.assertTrue(result['seq_scan'])
+
+    def test_explain_with_index(self):
+        self.cur.execute("""
+        create index people_bq_jdoc_gin on people using gin (bq_jdoc);
+        """)
+        self.conn.commit()
+        client = self._get_test_client()
+        client.connection.cursor().execute("set enable_seqscan = off;")
+
+        result = client['people'].explain({'city': 'London'})
+
+        self.assertTrue(result['index_used'])
+        self.assertIn('people_bq_jdoc_gin', result['indexes'])
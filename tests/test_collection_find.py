@@ -1,4 +1,5 @@
 import testutils
+import unittest
 import json
 import string
 import psycopg2
@@ -6,6 +7,12 @@ import pybedquilt
 import random
 import time
 
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    # python 2, without the futures backport
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
 
 class TestFindDocuments(testutils.BedquiltTestCase):
 
@@ -495,3 +502,493 @@ class TestFindWithSort(testutils.BedquiltTestCase):
         self.assertEqual(nums, [
             89, 88
         ])
+
+
+class TestFindWithStream(testutils.BedquiltTestCase):
+
+    def test_stream_on_empty_collection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        result = coll.find({}, stream=True)
+        self.assertEqual(list(result), [])
+
+    def test_stream_existing_documents(self):
+        client = self._get_test_client()
+        client.itersize = 7
+        coll = client['things']
+
+        for x in range(50):
+            coll.insert({'_id': 'doc{:02d}'.format(x), 'n': x})
+
+        result = coll.find({}, sort=[{'n': 1}], stream=True)
+        self.assertTrue(result.stream)
+        nums = list(map(lambda x: x['n'], result))
+        self.assertEqual(nums, list(range(50)))
+        self.assertTrue(result.cursor.closed)
+
+        result = coll.find({'n': {'$gte': 40}}, sort=[{'n': -1}],
+                           skip=2, limit=3, stream=True)
+        nums = list(map(lambda x: x['n'], result))
+        self.assertEqual(nums, [47, 46, 45])
+
+        result = coll.find_many_by_ids(['doc01', 'doc02', 'wat'],
+                                       stream=True)
+        ids = list(map(lambda x: x['_id'], result))
+        self.assertEqual(ids, ['doc01', 'doc02'])
+
+    def test_stream_by_default(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), stream=True, itersize=2)
+        coll = client['things']
+
+        for x in range(5):
+            coll.insert({'n': x})
+
+        result = coll.find(sort=[{'n': 1}])
+        self.assertTrue(result.stream)
+        self.assertEqual(list(map(lambda x: x['n'], result)),
+                         [0, 1, 2, 3, 4])
+
+        result = coll.find(sort=[{'n': 1}], stream=False)
+        self.assertFalse(result.stream)
+        self.assertEqual(len(list(result)), 5)
+
+    def test_stream_alongside_other_operations(self):
+        for pool_size in [None, 2]:
+            client = pybedquilt.BedquiltClient(
+                'dbname={}'.format(self.database_name), pool_size=pool_size)
+            coll = client['things']
+            coll.insert_many([{'_id': 'doc{}'.format(x), 'n': x}
+                              for x in range(5)])
+
+            result = coll.find(sort=[{'n': 1}], stream=True)
+            connection = result._connection
+            # without a pool, the cursor is held on the client's connection
+            self.assertEqual(connection is client.connection,
+                             pool_size is None)
+            cursor = connection.cursor()
+            cursor.execute("""
+            select is_holdable from pg_cursors where name = %s;
+            """, (result.cursor.name,))
+            self.assertEqual(cursor.fetchall(), [(pool_size is None,)])
+
+            # writes made while streaming are committed straight away
+            for doc in result:
+                doc['seen'] = True
+                coll.save(doc)
+                self.cur.execute("""
+                select bq_find_one_by_id('things', %s);
+                """, (doc['_id'],))
+                self.assertEqual(self.cur.fetchall()[0][0], doc)
+                self.conn.rollback()
+
+            self.assertTrue(result.cursor.closed)
+            self.assertFalse(connection.closed)
+            self.assertTrue(connection.autocommit)
+            if pool_size is not None:
+                self.assertEqual(len(client.pool._used), 0)
+            coll.remove({})
+            client.close()
+
+    def test_close_before_exhausted(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        for x in range(5):
+            coll.insert({'n': x})
+
+        result = coll.find(stream=True)
+        next(result)
+        result.close()
+        self.assertTrue(result.cursor.closed)
+        self.assertEqual(coll.count(), 5)
+
+
+class TestFindBatches(testutils.BedquiltTestCase):
+
+    def test_batches_on_empty_collection(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        result = coll.find()
+        self.assertEqual(result.next_batch(), [])
+        self.assertEqual(list(coll.find().iter_batches()), [])
+
+    def test_iter_batches(self):
+        client = self._get_test_client()
+        client.itersize = 4
+        coll = client['things']
+
+        for x in range(10):
+            coll.insert({'n': x})
+
+        for stream in [False, True]:
+            result = coll.find(sort=[{'n': 1}], stream=stream)
+            batches = list(result.iter_batches())
+            self.assertEqual(list(map(len, batches)), [4, 4, 2])
+            nums = [doc['n'] for batch in batches for doc in batch]
+            self.assertEqual(nums, list(range(10)))
+            self.assertEqual(result.next_batch(), [])
+
+    def test_mixing_next_and_next_batch(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        for x in range(10):
+            coll.insert({'n': x})
+
+        result = coll.find(sort=[{'n': 1}])
+        result.batch_size = 3
+        self.assertEqual(next(result)['n'], 0)
+        self.assertEqual(
+            list(map(lambda x: x['n'], result.next_batch())), [1, 2])
+        self.assertEqual(
+            list(map(lambda x: x['n'], result.next_batch())), [3, 4, 5])
+        self.assertEqual(next(result)['n'], 6)
+        self.assertEqual(list(map(lambda x: x['n'], result)), [7, 8, 9])
+
+
+class TestFindRaw(testutils.BedquiltTestCase):
+
+    def test_raw_on_empty_collection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        self.assertEqual(list(coll.find({}, raw=True)), [])
+        self.assertIsNone(coll.find_one({}, raw=True))
+        self.assertIsNone(coll.find_one_by_id('wat', raw=True))
+
+    def test_raw_documents(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        sarah = {'_id': "sarah@example.com",
+                 'name': "Sarah",
+                 'likes': ['icecream', 'cats']}
+        mike = {'_id': "mike@example.com",
+                'name': "Mike",
+                'likes': ['cats', 'crochet']}
+        coll.insert(sarah)
+        coll.insert(mike)
+
+        result = coll.find_one_by_id('sarah@example.com', raw=True)
+        self.assertIsInstance(result, str)
+        self.assertEqual(json.loads(result), sarah)
+
+        result = coll.find_one({'name': 'Mike'}, raw=True)
+        self.assertEqual(json.loads(result), mike)
+
+        for stream in [False, True]:
+            result = list(coll.find(sort=[{'name': 1}], raw=True,
+                                    stream=stream))
+            self.assertEqual(list(map(json.loads, result)), [mike, sarah])
+
+        result = list(coll.find_many_by_ids(['mike@example.com'], raw=True))
+        self.assertEqual(list(map(json.loads, result)), [mike])
+
+        # other queries on the same client still decode documents
+        self.assertEqual(coll.find_one_by_id('sarah@example.com'), sarah)
+
+
+class TestFindWithProjection(testutils.BedquiltTestCase):
+
+    def test_projection_on_empty_collection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        self.assertEqual(list(coll.find({}, projection=['name'])), [])
+        self.assertIsNone(coll.find_one({}, projection=['name']))
+        self.assertIsNone(coll.find_one_by_id('wat', projection=['name']))
+
+    def test_projection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        sarah = {'_id': "sarah@example.com",
+                 'name': "Sarah",
+                 'age': 34,
+                 'address': {'city': 'Glasgow', 'street': 'Mill Lane'},
+                 'likes': ['icecream', 'cats'],
+                 'nothing': None}
+        mike = {'_id': "mike@example.com",
+                'name': "Mike",
+                'age': 32}
+        coll.insert(sarah)
+        coll.insert(mike)
+
+        result = coll.find_one_by_id('sarah@example.com',
+                                     projection=['name', 'address.city'])
+        self.assertEqual(result, {'_id': 'sarah@example.com',
+                                  'name': 'Sarah',
+                                  'address': {'city': 'Glasgow'}})
+
+        result = coll.find_one({'name': 'Mike'},
+                               projection=['age', 'address.city', 'nothing'])
+        self.assertEqual(result, {'_id': 'mike@example.com', 'age': 32})
+
+        result = coll.find_one({'name': 'Sarah'},
+                               projection=['nothing', 'address',
+                                           'address.city'])
+        self.assertEqual(result, {'_id': 'sarah@example.com',
+                                  'nothing': None,
+                                  'address': sarah['address']})
+
+        result = coll.find_one({'name': 'Sarah'}, projection=[])
+        self.assertEqual(result, {'_id': 'sarah@example.com'})
+
+    def test_projection_with_skip_limit_and_sort(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        for x in range(10):
+            coll.insert({'_id': 'thing{}'.format(x), 'n': x,
+                         'color': 'red' if x % 2 else 'blue',
+                         'blob': 'x' * 1000})
+
+        result = coll.find({'color': 'red'}, sort=[{'n': -1}],
+                           skip=1, limit=2, projection=['n'])
+        self.assertEqual(list(result), [{'_id': 'thing7', 'n': 7},
+                                        {'_id': 'thing5', 'n': 5}])
+
+        result = coll.find({'color': 'blue'}, sort=[{'n': 1}],
+                           stream=True, projection=['n'])
+        self.assertEqual(list(map(lambda x: x['n'], result)), [0, 2, 4, 6, 8])
+
+        result = coll.find_one({}, sort=[{'n': -1}], skip=1,
+                               projection=['color'], raw=True)
+        self.assertEqual(json.loads(result), {'_id': 'thing8',
+                                              'color': 'blue'})
+
+
+class TestFindPage(testutils.BedquiltTestCase):
+
+    def _all_pages(self, coll, query_doc, sort, limit):
+        docs, token = coll.find_page(query_doc, sort=sort, limit=limit)
+        pages = [docs]
+        while token is not None:
+            docs, token = coll.find_page(query_doc, sort=sort, limit=limit,
+                                         after=token)
+            pages.append(docs)
+        return pages
+
+    def test_find_page_of_empty_collection(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        self.assertEqual(coll.find_page(), ([], None))
+
+    def test_pages_by_id(self):
+        client = self._get_test_client()
+        coll = client['things']
+        for x in range(10):
+            coll.insert({'_id': 'thing{}'.format(x), 'n': x})
+
+        pages = self._all_pages(coll, {}, None, 4)
+
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual([doc['_id'] for page in pages for doc in page],
+                         ['thing{}'.format(x) for x in range(10)])
+
+    def test_pages_with_sort_and_ties(self):
+        client = self._get_test_client()
+        coll = client['people']
+        for x in range(20):
+            coll.insert({'_id': 'user{:02d}'.format(x),
+                         'age': x % 3,
+                         'name': 'name{}'.format(x % 4)})
+
+        sort = [{'age': -1}, {'name': 1}]
+        expected = list(coll.find(sort=sort + [{'_id': 1}]))
+
+        for limit in [1, 3, 7, 20, 50]:
+            pages = self._all_pages(coll, {}, sort, limit)
+            self.assertEqual([doc for page in pages for doc in page],
+                             expected)
+            self.assertTrue(all(0 < len(page) <= limit for page in pages))
+
+    def test_pages_with_query(self):
+        client = self._get_test_client()
+        coll = client['things']
+        for x in range(30):
+            coll.insert({'_id': 'thing{:02d}'.format(x), 'n': x,
+                         'color': 'red' if x % 2 else 'blue'})
+
+        pages = self._all_pages(
+            coll, {'color': 'red', 'n': {'$lt': 20}}, [{'n': 1}], 3)
+
+        self.assertEqual([doc['n'] for page in pages for doc in page],
+                         [1, 3, 5, 7, 9, 11, 13, 15, 17, 19])
+
+    def test_pages_skip_documents_missing_sort_key(self):
+        client = self._get_test_client()
+        coll = client['people']
+        for x in range(12):
+            doc = {'_id': 'user{:02d}'.format(x)}
+            if x % 3:
+                doc['age'] = x % 4
+            coll.insert(doc)
+
+        for direction in [1, -1]:
+            sort = [{'age': direction}]
+            expected = list(coll.find({'age': {'$exists': True}},
+                                      sort=sort + [{'_id': 1}]))
+            self.assertEqual(len(expected), 8)
+            for limit in [1, 3, 8, 20]:
+                pages = self._all_pages(coll, {}, sort, limit)
+                self.assertEqual([doc for page in pages for doc in page],
+                                 expected)
+
+        # the caller's query is left unchanged
+        query_doc = {'age': {'$gte': 1}}
+        coll.find_page(query_doc, sort=[{'age': 1}], limit=2)
+        self.assertEqual(query_doc, {'age': {'$gte': 1}})
+
+    def test_exact_page_size_has_no_empty_last_page(self):
+        client = self._get_test_client()
+        coll = client['things']
+        for x in range(4):
+            coll.insert({'_id': 'thing{}'.format(x), 'n': x})
+
+        docs, token = coll.find_page(sort=[{'n': 1}], limit=2)
+        docs, token = coll.find_page(sort=[{'n': 1}], limit=2, after=token)
+        self.assertEqual([doc['n'] for doc in docs], [2, 3])
+        self.assertIsNone(token)
+
+    def test_invalid_token(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert({'_id': 'thing0', 'n': 0})
+        coll.insert({'_id': 'thing1', 'n': 1})
+
+        _, token = coll.find_page(sort=[{'n': 1}], limit=1)
+
+        with self.assertRaises(Exception):
+            coll.find_page(sort=[{'n': 1}, {'name': 1}], after=token)
+        with self.assertRaises(Exception):
+            coll.find_page(sort=[{'n': 1}], after='not a token')
+
+
+class TestParallelScan(testutils.BedquiltTestCase):
+
+    def _get_pooled_collection(self, pool_size=4):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=pool_size)
+        coll = client['things']
+        # padded, so that the documents fill several blocks of the table
+        coll.insert_many([{'_id': 'thing{:03d}'.format(x), 'n': x,
+                           'color': 'red' if x % 2 else 'blue',
+                           'padding': 'x' * 500}
+                          for x in range(100)])
+        return coll
+
+    def test_partitions_are_disjoint_and_complete(self):
+        coll = self._get_pooled_collection()
+
+        cursors = coll.parallel_scan(partitions=4, batch_size=7)
+        self.assertEqual(len(cursors), 4)
+
+        partitions = [[doc['n'] for doc in cursor] for cursor in cursors]
+        self.assertTrue(all(partitions))
+        self.assertEqual(sorted(n for partition in partitions
+                                for n in partition), list(range(100)))
+
+    def test_merged_scan_with_query(self):
+        coll = self._get_pooled_collection()
+
+        result = coll.parallel_scan({'color': 'red'}, partitions=3,
+                                    merge=True, batch_size=5)
+        self.assertEqual(sorted(doc['n'] for doc in result),
+                         list(range(1, 100, 2)))
+
+    def test_abandoned_merged_scan_releases_connections(self):
+        coll = self._get_pooled_collection(pool_size=2)
+
+        result = coll.parallel_scan(partitions=2, merge=True, batch_size=1)
+        next(result)
+        result.close()
+
+        self.assertEqual(coll.count(), 100)
+        self.assertEqual(len(list(
+            coll.parallel_scan(partitions=2, merge=True))), 100)
+
+    def test_partitions_without_pool(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert_many([{'_id': 'thing{:03d}'.format(x)}
+                          for x in range(100)])
+
+        cursors = coll.parallel_scan(partitions=3)
+        connections = [cursor._connection for cursor in cursors]
+        # one server process per partition, apart from the client's own
+        pids = set(connection.get_backend_pid() for connection in connections)
+        self.assertEqual(len(pids), 3)
+        self.assertNotIn(client.connection.get_backend_pid(), pids)
+
+        ids = [doc['_id'] for cursor in cursors for doc in cursor]
+        self.assertEqual(sorted(ids),
+                         ['thing{:03d}'.format(x) for x in range(100)])
+        self.assertTrue(all(connection.closed for connection in connections))
+
+    def test_too_many_partitions_for_pool(self):
+        coll = self._get_pooled_collection(pool_size=2)
+
+        with self.assertRaises(AssertionError):
+            coll.parallel_scan(partitions=3)
+
+    def test_partitions_read_their_own_blocks(self):
+        coll = self._get_pooled_collection()
+        self.cur.execute("""
+        select bq_jdoc->>'_id', (ctid::text::point)[0] from things;
+        """)
+        blocks = dict(self.cur.fetchall())
+
+        cursors = coll.parallel_scan(partitions=4)
+        ranges = [sorted(blocks[doc['_id']] for doc in cursor)
+                  for cursor in cursors]
+        # each partition reads a range of blocks after the one before
+        self.assertTrue(all(ranges))
+        for before, after in zip(ranges, ranges[1:]):
+            self.assertLess(before[-1], after[0])
+
+    def test_parallel_scan_of_missing_collection(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), pool_size=2)
+
+        result = client['nothing'].parallel_scan(partitions=2, merge=True)
+        self.assertEqual(list(result), [])
+
+    def test_parallel_scan_rejects_query_operators(self):
+        coll = self._get_pooled_collection()
+
+        with self.assertRaises(AssertionError):
+            coll.parallel_scan({'n': {'$gt': 10}})
+
+
+@unittest.skipIf(ProcessPoolExecutor is None,
+                 "concurrent.futures is not available")
+class TestFindDecodeWith(testutils.BedquiltTestCase):
+
+    def test_decode_on_process_pool(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert_many([{'_id': 'thing{:03d}'.format(x), 'n': x,
+                           'items': [{'i': i} for i in range(x % 5)]}
+                          for x in range(100)])
+        expected = list(coll.find(sort=[{'n': 1}]))
+
+        with ProcessPoolExecutor(2) as executor:
+            for stream in [False, True]:
+                cursor = coll.find(sort=[{'n': 1}], stream=stream, raw=True)
+                result = list(cursor.decode_with(executor, chunk_size=7,
+                                                 prefetch=2))
+                self.assertEqual(result, expected)
+
+    def test_decode_with_requires_raw_cursor(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert({'_id': 'thing'})
+
+        with ThreadPoolExecutor(1) as executor:
+            with self.assertRaises(AssertionError):
+                list(coll.find().decode_with(executor))
@@ -0,0 +1,114 @@
+import testutils
+import psycopg2
+
+
+class TestIndexes(testutils.BedquiltTestCase):
+
+    def _index_names(self, coll):
+        return [index['name'] for index in coll.list_indexes()]
+
+    def test_create_list_and_drop_btree_index(self):
+        coll = self._get_test_client()['people']
+
+        name = coll.create_index(['address.city', 'age'])
+        self.assertIn(name, self._index_names(coll))
+        definition = [index['definition'] for index in coll.list_indexes()
+                      if index['name'] == name][0]
+        self.assertIn('btree', definition)
+        self.assertIn('address', definition)
+
+        # creating it again does nothing
+        self.assertEqual(coll.create_index(['address.city', 'age']), name)
+
+        self.assertTrue(coll.drop_index(name))
+        self.assertNotIn(name, self._index_names(coll))
+        self.assertFalse(coll.drop_index(name))
+
+    def test_create_gin_index(self):
+        coll = self._get_test_client()['people']
+
+        name = coll.create_index(kind='gin', name='people_docs')
+        self.assertEqual(name, 'people_docs')
+        definition = [index['definition'] for index in coll.list_indexes()
+                      if index['name'] == name][0]
+        self.assertIn('gin', definition)
+        self.assertIn('jsonb_path_ops', definition)
+
+        coll.insert({'_id': 'sarah@example.com', 'city': 'London'})
+        self.assertEqual(coll.count({'city': 'London'}), 1)
+
+    def test_unique_index(self):
+        coll = self._get_test_client()['people']
+        coll.create_index(['email'], unique=True)
+
+        coll.insert({'email': 'sarah@example.com'})
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.insert({'email': 'sarah@example.com'})
+        coll.insert({'email': 'mike@example.com'})
+        self.assertEqual(coll.count(), 2)
+
+    def test_partial_unique_index(self):
+        coll = self._get_test_client()['people']
+        coll.create_index(['email'], unique=True, where={'active': True})
+
+        coll.insert({'email': 'sarah@example.com', 'active': False})
+        coll.insert({'email': 'sarah@example.com', 'active': True})
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.insert({'email': 'sarah@example.com', 'active': True})
+
+    def test_create_index_concurrently(self):
+        coll = self._get_test_client()['people']
+        coll.insert_many([{'n': n} for n in range(100)])
+
+        name = coll.create_index(['n'], concurrently=True)
+        self.assertIn(name, self._index_names(coll))
+        self.assertTrue(coll.drop_index(name, concurrently=True))
+
+    def test_invalid_indexes(self):
+        coll = self._get_test_client()['people']
+
+        with self.assertRaises(AssertionError):
+            coll.create_index()
+        with self.assertRaises(AssertionError):
+            coll.create_index(['n'], kind='hash')
+        with self.assertRaises(AssertionError):
+            coll.create_index(kind='gin', unique=True)
+        with self.assertRaises(AssertionError):
+            coll.create_index(['n'], unique=True, where={'n': {'$gt': 1}})
+        # indexes which bedquilt queries could not use
+        with self.assertRaises(AssertionError):
+            coll.create_index(['city'], kind='gin')
+        with self.assertRaises(AssertionError):
+            coll.create_index(['n'], where={'active': True})
+        with self.assertRaises(AssertionError):
+            coll.create_index(kind='gin', where={'active': True})
+
+    def _explain(self, client, coll, *args, **kwargs):
+        # with sequential scans off, any index which can be used is
+        client.connection.cursor().execute("set enable_seqscan = off;")
+        try:
+            return coll.explain(*args, **kwargs)
+        except psycopg2.Error:
+            self.skipTest("auto_explain is not available")
+
+    def _people(self, client):
+        coll = client['people']
+        coll.insert_many([{'city': 'London' if n % 2 else 'Paris',
+                           'age': n % 50} for n in range(200)])
+        return coll
+
+    def test_gin_index_is_used(self):
+        client = self._get_test_client()
+        coll = self._people(client)
+        name = coll.create_index(kind='gin')
+
+        result = self._explain(client, coll, {'city': 'London'})
+        self.assertIn(name, result['indexes'])
+
+    def test_btree_index_is_used_for_sorts(self):
+        client = self._get_test_client()
+        coll = self._people(client)
+        name = coll.create_index(['age'])
+
+        result = self._explain(client, coll, sort=[{'age': 1}], limit=10)
+        self.assertIn(name, result['indexes'])
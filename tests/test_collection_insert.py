@@ -96,3 +96,58 @@ class TestInsertDocument(testutils.BedquiltTestCase):
 
         result = coll.find()
         self.assertEqual(len(list(result)), 1)
+
+
+class TestInsertManyDocuments(testutils.BedquiltTestCase):
+
+    def test_insert_many_empty_list(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        result = coll.insert_many([])
+        self.assertEqual(result, [])
+
+    def test_insert_many_into_non_existant_collection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        docs = [
+            {"_id": "sarah@example.com", "name": "Sarah"},
+            {"name": "Mike"},
+            {"_id": "jill@example.com", "name": "Jill"}
+        ]
+        result = coll.insert_many(docs)
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0], "sarah@example.com")
+        self.assertEqual(len(result[1]), 24)
+        self.assertEqual(result[2], "jill@example.com")
+
+        self.assertEqual(client.list_collections(), ["people"])
+        self.assertEqual(coll.find_one_by_id(result[1])['name'], 'Mike')
+
+    def test_insert_many_in_batches(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        docs = [{'_id': 'thing{:03d}'.format(x), 'n': x}
+                for x in range(25)]
+        result = coll.insert_many(docs, batch_size=7)
+
+        self.assertEqual(result, [doc['_id'] for doc in docs])
+        self.assertEqual(coll.count(), 25)
+
+    def test_insert_many_with_repeat_id(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        coll.insert({"_id": "user_one"})
+
+        docs = [{"_id": "user_{}".format(x)} for x in range(10)]
+        docs.append({"_id": "user_one"})
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.insert_many(docs, batch_size=3)
+
+        # nothing from the failed call should have been inserted
+        result = coll.find()
+        self.assertEqual(len(list(result)), 1)
@@ -0,0 +1,69 @@
+import testutils
+import io
+import psycopg2
+
+
+class TestLoadDocuments(testutils.BedquiltTestCase):
+
+    def test_load_into_non_existant_collection(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        docs = [
+            {"_id": "sarah@example.com", "name": "Sarah"},
+            {"name": "Mike", "likes": ["tabs\tand\\slashes"]}
+        ]
+        result = coll.load(docs)
+
+        self.assertEqual(result, 2)
+        self.assertEqual(client.list_collections(), ["people"])
+        self.assertEqual(coll.find_one_by_id("sarah@example.com"), docs[0])
+
+        mike = coll.find_one({"name": "Mike"})
+        self.assertEqual(len(mike['_id']), 24)
+        self.assertEqual(mike['likes'], ["tabs\tand\\slashes"])
+
+    def test_load_from_generator(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        result = coll.load({'n': x} for x in range(1000))
+
+        self.assertEqual(result, 1000)
+        self.assertEqual(coll.count(), 1000)
+        self.assertEqual(coll.count({'n': 999}), 1)
+
+    def test_load_from_file(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        source = io.StringIO(u'{"_id": "a", "n": 1}\n'
+                             u'\n'
+                             u'{"_id": "b",\t"n": 2}\n')
+        result = coll.load(source)
+
+        self.assertEqual(result, 2)
+        self.assertEqual(coll.find_one_by_id('b'), {'_id': 'b', 'n': 2})
+
+    def test_load_applies_constraints(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        coll.add_constraints({'name': {'$required': 1}})
+
+        docs = [{'name': 'Sarah'}, {'age': 20}]
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.load(docs)
+
+        self.assertEqual(coll.count(), 0)
+
+    def test_load_with_repeat_id(self):
+        client = self._get_test_client()
+        coll = client['people']
+
+        coll.insert({'_id': 'user_one'})
+
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.load([{'_id': 'user_two'}, {'_id': 'user_one'}])
+
+        self.assertEqual(coll.count(), 1)
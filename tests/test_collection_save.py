@@ -85,3 +85,45 @@ class TestSaveDocuments(testutils.BedquiltTestCase):
                              dud,
                              doc
                          ])
+
+
+class TestSaveManyDocuments(testutils.BedquiltTestCase):
+
+    def test_save_many_empty_list(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        self.assertEqual(coll.save_many([]), [])
+
+    def test_save_many_into_non_existant_collection(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        result = coll.save_many([{"_id": "aaa", "a": 1}, {"a": 2}])
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0], "aaa")
+        self.assertEqual(len(result[1]), 24)
+        self.assertEqual(coll.count(), 2)
+
+    def test_save_many_overwriting_docs(self):
+        client = self._get_test_client()
+        coll = client['things']
+
+        docs = [{'_id': 'thing{:02d}'.format(x), 'n': x} for x in range(20)]
+        coll.insert_many(docs)
+
+        for doc in docs:
+            doc['n'] = doc['n'] * 10
+            doc['color'] = 'blue'
+        docs.append({'_id': 'thing00', 'n': -1})
+
+        result = coll.save_many(docs, batch_size=6)
+
+        self.assertEqual(result, [doc['_id'] for doc in docs])
+        self.assertEqual(coll.count(), 20)
+        self.assertEqual(coll.count({'color': 'blue'}), 19)
+        self.assertEqual(coll.find_one_by_id('thing07'),
+                         {'_id': 'thing07', 'n': 70, 'color': 'blue'})
+        self.assertEqual(coll.find_one_by_id('thing00'),
+                         {'_id': 'thing00', 'n': -1})
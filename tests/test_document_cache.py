@@ -0,0 +1,225 @@
+import testutils
+import json
+import time
+import pybedquilt
+
+
+class TestDocumentCache(testutils.BedquiltTestCase):
+
+    def test_lru_eviction(self):
+        cache = pybedquilt.DocumentCache(max_size=2)
+
+        cache.put('people', 'one', {'_id': 'one'})
+        cache.put('people', 'two', {'_id': 'two'})
+        self.assertEqual(cache.get('people', 'one'), {'_id': 'one'})
+
+        cache.put('people', 'three', {'_id': 'three'})
+        self.assertIsNone(cache.get('people', 'two'))
+        self.assertEqual(cache.get('people', 'one'), {'_id': 'one'})
+        self.assertEqual(cache.get('people', 'three'), {'_id': 'three'})
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_ttl(self):
+        cache = pybedquilt.DocumentCache(ttl=0.05)
+
+        cache.put('people', 'one', {'_id': 'one'})
+        self.assertEqual(cache.get('people', 'one'), {'_id': 'one'})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('people', 'one'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_returns_copies(self):
+        cache = pybedquilt.DocumentCache()
+
+        doc = {'_id': 'one', 'tags': ['a']}
+        cache.put('people', 'one', doc)
+        doc['tags'].append('b')
+        cache.get('people', 'one')['tags'].append('c')
+
+        self.assertEqual(cache.get('people', 'one'),
+                         {'_id': 'one', 'tags': ['a']})
+
+    def test_invalidate(self):
+        cache = pybedquilt.DocumentCache()
+        cache.put('people', 'one', {'_id': 'one'})
+        cache.put('people', 'two', {'_id': 'two'})
+        cache.put('things', 'one', {'_id': 'one'})
+
+        cache.invalidate('people', ['one'])
+        self.assertIsNone(cache.get('people', 'one'))
+        self.assertIsNotNone(cache.get('people', 'two'))
+
+        cache.invalidate('people')
+        self.assertIsNone(cache.get('people', 'two'))
+        self.assertIsNotNone(cache.get('things', 'one'))
+
+
+class TestClientDocumentCache(testutils.BedquiltTestCase):
+
+    def _get_caching_client(self, **kwargs):
+        return pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name), cache_size=100,
+            **kwargs)
+
+    def test_no_cache_by_default(self):
+        client = self._get_test_client()
+        self.assertIsNone(client.cache)
+
+    def test_find_one_by_id_is_cached(self):
+        client = self._get_caching_client()
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+
+        self.assertIsNone(coll.find_one_by_id('mike@example.com'))
+        doc = coll.find_one_by_id('sarah@example.com')
+        self.assertEqual(doc['name'], 'Sarah')
+
+        # change the document behind the client's back
+        self.cur.execute("""
+        update people set bq_jdoc = bq_jdoc || '{"name": "Changed"}'
+        """)
+        self.conn.commit()
+
+        doc = coll.find_one_by_id('sarah@example.com')
+        self.assertEqual(doc['name'], 'Sarah')
+        self.assertEqual(client.cache.stats()['hits'], 1)
+        self.assertEqual(client.cache.stats()['misses'], 2)
+
+        # raw and projected reads bypass the cache
+        self.assertEqual(coll.find_one_by_id(
+            'sarah@example.com', projection=['name'])['name'], 'Changed')
+
+    def test_writes_invalidate(self):
+        client = self._get_caching_client()
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+        coll.insert({'_id': 'mike@example.com', 'name': 'Mike'})
+
+        coll.find_one_by_id('sarah@example.com')
+        coll.save({'_id': 'sarah@example.com', 'name': 'Sarah Jane'})
+        self.assertEqual(coll.find_one_by_id('sarah@example.com')['name'],
+                         'Sarah Jane')
+
+        coll.save_many([{'_id': 'sarah@example.com', 'name': 'SJ'}])
+        self.assertEqual(coll.find_one_by_id('sarah@example.com')['name'],
+                         'SJ')
+
+        coll.remove_one_by_id('sarah@example.com')
+        self.assertIsNone(coll.find_one_by_id('sarah@example.com'))
+
+        coll.find_one_by_id('mike@example.com')
+        coll.remove({'name': 'Mike'})
+        self.assertIsNone(coll.find_one_by_id('mike@example.com'))
+
+    def test_pipeline_writes_invalidate(self):
+        client = self._get_caching_client()
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+        coll.find_one_by_id('sarah@example.com')
+
+        with coll.batch() as batch:
+            batch.remove_many_by_ids(['sarah@example.com'])
+
+        self.assertIsNone(coll.find_one_by_id('sarah@example.com'))
+
+    def test_cache_ttl(self):
+        client = self._get_caching_client(cache_ttl=0.05)
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+        coll.find_one_by_id('sarah@example.com')
+
+        self.cur.execute("delete from people")
+        self.conn.commit()
+        time.sleep(0.1)
+
+        self.assertIsNone(coll.find_one_by_id('sarah@example.com'))
+
+
+class TestCacheInvalidationListener(testutils.BedquiltTestCase):
+
+    def _get_listening_client(self):
+        client = pybedquilt.BedquiltClient(
+            'dbname={}'.format(self.database_name),
+            cache_size=100, cache_listen=True)
+        self.assertTrue(client._listener.listening.wait(5))
+        return client
+
+    def _wait_for_eviction(self, client, collection_name, doc_id):
+        for _ in range(50):
+            if client.cache.get(collection_name, doc_id) is None:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_writes_by_other_clients_invalidate(self):
+        client = self._get_listening_client()
+        other = self._get_test_client()
+        coll = client['people']
+        coll.add_invalidation_trigger()
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+        coll.insert({'_id': 'mike@example.com', 'name': 'Mike'})
+
+        coll.find_one_by_id('sarah@example.com')
+        coll.find_one_by_id('mike@example.com')
+        other['people'].save({'_id': 'sarah@example.com', 'name': 'SJ'})
+
+        self.assertTrue(self._wait_for_eviction(
+            client, 'people', 'sarah@example.com'))
+        self.assertEqual(coll.find_one_by_id('sarah@example.com')['name'],
+                         'SJ')
+
+        # a direct update to the table is seen too
+        self.cur.execute("delete from people")
+        self.conn.commit()
+
+        self.assertTrue(self._wait_for_eviction(
+            client, 'people', 'mike@example.com'))
+        self.assertIsNone(coll.find_one_by_id('mike@example.com'))
+        client.close()
+
+    def test_bulk_changes_invalidate_the_collection_once(self):
+        coll = self._get_test_client()['people']
+        coll.add_invalidation_trigger()
+        coll.insert_many([{'_id': 'user{}'.format(x), 'n': x}
+                          for x in range(50)])
+        limit = pybedquilt.core.MAX_ROW_INVALIDATIONS
+        self.cur.execute("listen pybedquilt_invalidate;")
+        self.conn.commit()
+
+        # one notification per document up to the limit, then one for
+        # the whole collection, within each statement
+        for _ in range(2):
+            self.assertEqual(coll.remove_one_by_id('user0'), 1)
+            coll.insert({'_id': 'user0', 'n': 0})
+        self.assertEqual(coll.remove({}), 50)
+        for _ in range(50):
+            self.conn.poll()
+            if len(self.conn.notifies) >= limit + 3:
+                break
+            time.sleep(0.1)
+        messages = [json.loads(notify.payload)
+                    for notify in self.conn.notifies]
+        self.assertEqual(messages[:2], [
+            {'collection': 'people', '_id': 'user0'}] * 2)
+        removed = messages[2:]
+        self.assertEqual(len(removed), limit + 1)
+        self.assertTrue(all(message['_id'] for message in removed[:limit]))
+        self.assertEqual(removed[-1], {'collection': 'people', '_id': None})
+
+    def test_add_invalidation_trigger_twice(self):
+        coll = self._get_test_client()['people']
+        coll.add_invalidation_trigger()
+        coll.add_invalidation_trigger()
+
+        coll.insert({'_id': 'sarah@example.com'})
+        self.assertEqual(coll.remove_one_by_id('sarah@example.com'), 1)
+
+    def test_cache_listen_requires_cache(self):
+        with self.assertRaises(AssertionError):
+            pybedquilt.BedquiltClient(
+                'dbname={}'.format(self.database_name), cache_listen=True)
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cumulative microseconds `import pybedquilt` may take, as reported by
+# `python -X importtime`. Override with PYBEDQUILT_IMPORT_BUDGET_US.
+IMPORT_BUDGET_US = int(
+    os.environ.get('PYBEDQUILT_IMPORT_BUDGET_US', 20000))
+
+
+def _import_pybedquilt(statement="import pybedquilt"):
+    """
+    Import pybedquilt in a fresh interpreter.
+    Returns: tuple of (cumulative import time in microseconds,
+    list of the names of all modules imported).
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c',
+         statement + "; import sys; print(' '.join(sys.modules))"],
+        cwd=ROOT, stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = None
+    modules = []
+    for line in output.splitlines():
+        if line.startswith('import time:'):
+            fields = line[len('import time:'):].split('|')
+            if fields[2].strip() == 'pybedquilt':
+                elapsed = int(fields[1])
+        else:
+            modules = line.split()
+    return elapsed, modules
+
+
+@unittest.skipIf(sys.version_info < (3, 7),
+                 "lazy imports and -X importtime need python 3.7")
+class TestImportTime(unittest.TestCase):
+
+    def test_import_does_not_load_driver(self):
+        _, modules = _import_pybedquilt()
+
+        self.assertIn('pybedquilt', modules)
+        self.assertNotIn('pybedquilt.core', modules)
+        self.assertNotIn('psycopg2', modules)
+        self.assertNotIn('six', modules)
+
+    def test_import_time_budget(self):
+        # best of a few runs, to smooth out a busy machine
+        elapsed = min(_import_pybedquilt()[0] for _ in range(3))
+
+        self.assertLessEqual(
+            elapsed, IMPORT_BUDGET_US,
+            "import pybedquilt took {}us, over the budget of {}us".format(
+                elapsed, IMPORT_BUDGET_US))
+
+    def test_names_load_on_first_use(self):
+        _, modules = _import_pybedquilt(
+            "from pybedquilt import BedquiltClient")
+
+        self.assertIn('pybedquilt.core', modules)
+        self.assertIn('psycopg2', modules)
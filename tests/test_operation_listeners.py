@@ -0,0 +1,112 @@
+import testutils
+import psycopg2
+import pybedquilt
+
+
+class RecordingListener(pybedquilt.OperationListener):
+
+    def __init__(self):
+        self.started_events = []
+        self.finished_events = []
+
+    def started(self, event):
+        self.unfinished_when_started = event.duration is None
+        self.started_events.append(event)
+
+    def finished(self, event):
+        self.finished_events.append(event)
+
+
+class TestOperationListeners(testutils.BedquiltTestCase):
+
+    def test_query_events(self):
+        client = self._get_test_client()
+        listener = RecordingListener()
+        client.add_listener(listener)
+        coll = client['people']
+
+        coll.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+        coll.find_one_by_id('sarah@example.com')
+        coll.count()
+
+        self.assertEqual(
+            [event.operation for event in listener.finished_events],
+            ['bq_insert', 'bq_find_one_by_id', 'bq_count'])
+        self.assertEqual(listener.started_events, listener.finished_events)
+        self.assertTrue(listener.unfinished_when_started)
+        for event in listener.finished_events:
+            self.assertEqual(event.collection, 'people')
+            self.assertEqual(event.rows, 1)
+            self.assertIsNone(event.error)
+            self.assertGreater(event.duration, 0)
+            self.assertGreater(event.bytes_sent, 0)
+
+        find_one = listener.finished_events[1]
+        self.assertEqual(find_one.bytes_received,
+                         len('{"_id": "sarah@example.com", "name": "Sarah"}'))
+        self.assertEqual(find_one.params, ('people', 'sarah@example.com'))
+
+    def test_bytes_received_of_non_ascii_documents(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert({'_id': 'thing', 'name': u'\xe9clair'})
+        listener = RecordingListener()
+        client.add_listener(listener)
+
+        coll.find_one_by_id('thing')
+        event = listener.finished_events[0]
+        self.assertEqual(event.bytes_received, len(
+            u'{"_id": "thing", "name": "\xe9clair"}'.encode('utf-8')))
+
+    def test_cursor_events(self):
+        client = self._get_test_client()
+        coll = client['things']
+        coll.insert_many([{'_id': 'thing{}'.format(x)} for x in range(10)])
+        listener = RecordingListener()
+        client.add_listener(listener)
+
+        for stream in [False, True]:
+            cursor = coll.find(stream=stream, batch_size=3)
+            self.assertEqual(len(listener.started_events), 1)
+            self.assertEqual(listener.finished_events, [])
+
+            self.assertEqual(len(list(cursor)), 10)
+            event = listener.finished_events.pop()
+            self.assertEqual(event.operation, 'bq_find')
+            self.assertEqual(event.rows, 10)
+            self.assertGreater(event.bytes_received, 0)
+            listener.started_events = []
+
+    def test_error_events(self):
+        client = self._get_test_client()
+        listener = RecordingListener()
+        client.add_listener(listener)
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com'})
+
+        with self.assertRaises(psycopg2.IntegrityError):
+            coll.insert({'_id': 'sarah@example.com'})
+
+        event = listener.finished_events[-1]
+        self.assertIsInstance(event.error, psycopg2.IntegrityError)
+        self.assertIsNone(event.rows)
+
+    def test_remove_listener(self):
+        client = self._get_test_client()
+        listener = RecordingListener()
+        client.add_listener(listener)
+        client['people'].count()
+        client.remove_listener(listener)
+        client['people'].count()
+
+        self.assertEqual(len(listener.finished_events), 1)
+
+    def test_failing_listener_does_not_break_operations(self):
+        client = self._get_test_client()
+
+        class FailingListener(pybedquilt.OperationListener):
+            def finished(self, event):
+                raise ValueError()
+
+        client.add_listener(FailingListener())
+        self.assertEqual(client['people'].count(), 0)
@@ -0,0 +1,119 @@
+import testutils
+import psycopg2
+
+
+class TestPipeline(testutils.BedquiltTestCase):
+
+    def test_empty_pipeline(self):
+        client = self._get_test_client()
+
+        with client.pipeline() as pipeline:
+            pass
+
+        self.assertEqual(pipeline.execute(), [])
+
+    def test_mixed_operations_across_collections(self):
+        client = self._get_test_client()
+        client['people'].insert({'_id': 'mike@example.com', 'name': 'Mike'})
+
+        with client.pipeline() as pipeline:
+            people = pipeline['people']
+            one = people.insert({'_id': 'sarah@example.com', 'name': 'Sarah'})
+            two = pipeline['things'].save({'_id': 'lamp', 'colour': 'red'})
+            three = people.remove_one_by_id('mike@example.com')
+            four = people.find_one_by_id('sarah@example.com')
+            five = people.count()
+            self.assertFalse(one.done())
+
+        self.assertTrue(one.done())
+        self.assertEqual(one.result(), 'sarah@example.com')
+        self.assertEqual(two.result(), 'lamp')
+        self.assertEqual(three.result(), 1)
+        self.assertEqual(four.result(),
+                         {'_id': 'sarah@example.com', 'name': 'Sarah'})
+        self.assertEqual(five.result(), 1)
+
+        self.assertEqual(client['things'].find_one_by_id('lamp'),
+                         {'_id': 'lamp', 'colour': 'red'})
+
+    def test_find_one_of_missing_document(self):
+        client = self._get_test_client()
+
+        with client['people'].batch() as batch:
+            one = batch.find_one({'name': 'Nobody'})
+            two = batch.find_one_by_id('nobody@example.com')
+
+        self.assertIsNone(one.result())
+        self.assertIsNone(two.result())
+
+    def test_result_before_execute(self):
+        client = self._get_test_client()
+
+        pipeline = client.pipeline()
+        result = pipeline['people'].insert({'name': 'Sarah'})
+
+        with self.assertRaises(Exception):
+            result.result()
+
+        self.assertEqual(pipeline.execute(), [result.result()])
+        self.assertEqual(len(result.result()), 24)
+
+    def test_in_batches(self):
+        client = self._get_test_client()
+
+        with client.pipeline(batch_size=3) as pipeline:
+            results = [pipeline['things'].insert({'_id': 'thing{}'.format(n)})
+                       for n in range(10)]
+
+        self.assertEqual([result.result() for result in results],
+                         ['thing{}'.format(n) for n in range(10)])
+        self.assertEqual(client['things'].count(), 10)
+
+    def test_failure_rolls_back_transaction(self):
+        client = self._get_test_client()
+        client['people'].insert({'_id': 'user_one'})
+
+        with self.assertRaises(psycopg2.IntegrityError):
+            with client.pipeline(batch_size=1) as pipeline:
+                one = pipeline['people'].insert({'_id': 'user_two'})
+                two = pipeline['people'].insert({'_id': 'user_one'})
+
+        with self.assertRaises(psycopg2.IntegrityError):
+            one.result()
+        with self.assertRaises(psycopg2.IntegrityError):
+            two.result()
+        self.assertEqual(client['people'].count(), 1)
+
+    def test_failure_without_transaction(self):
+        client = self._get_test_client()
+        client['people'].insert({'_id': 'user_one'})
+
+        with self.assertRaises(psycopg2.IntegrityError):
+            with client.pipeline(transaction=False,
+                                 batch_size=1) as pipeline:
+                one = pipeline['people'].insert({'_id': 'user_two'})
+                two = pipeline['people'].insert({'_id': 'user_one'})
+
+        self.assertEqual(one.result(), 'user_two')
+        with self.assertRaises(psycopg2.IntegrityError):
+            two.result()
+        self.assertEqual(client['people'].count(), 2)
+
+    def test_no_transaction_requires_batch_size(self):
+        client = self._get_test_client()
+
+        with self.assertRaises(AssertionError):
+            client.pipeline(transaction=False)
+        with self.assertRaises(AssertionError):
+            client['people'].batch(transaction=False)
+
+    def test_nothing_sent_on_exception(self):
+        client = self._get_test_client()
+
+        with self.assertRaises(ValueError):
+            with client.pipeline() as pipeline:
+                result = pipeline['people'].insert({'name': 'Sarah'})
+                raise ValueError()
+
+        self.assertFalse(result.done())
+        self.assertEqual(client['people'].count(), 0)
@@ -0,0 +1,90 @@
+import testutils
+from pybedquilt.core import OperationEvent
+
+
+class TestSlowOperationLog(testutils.BedquiltTestCase):
+
+    def test_records_operations_over_threshold(self):
+        client = self._get_test_client()
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'age': 27})
+
+        slow_log = client.enable_slow_log(0)
+        coll.find_one({'age': 27}, skip=0, sort=[{'age': 1}])
+        list(coll.find({'age': {'$gt': 20}}, limit=5, sort=[{'age': -1}]))
+        coll.count({'age': 27})
+
+        entries = slow_log.entries()
+        self.assertEqual([entry['operation'] for entry in entries],
+                         ['bq_find_one', 'bq_find', 'bq_count'])
+        self.assertEqual(entries[1]['args'], {
+            'collection': 'people',
+            'query_doc': {'age': {'$gt': 20}},
+            'skip': 0,
+            'limit': 5,
+            'sort': [{'age': -1}]})
+        for entry in entries:
+            self.assertEqual(entry['collection'], 'people')
+            self.assertGreaterEqual(entry['duration'], 0)
+            self.assertIsNone(entry['plans'])
+
+        slow_log.clear()
+        self.assertEqual(slow_log.entries(), [])
+
+    def test_ignores_fast_operations(self):
+        client = self._get_test_client()
+        slow_log = client.enable_slow_log(60)
+
+        client['people'].count()
+        self.assertEqual(slow_log.entries(), [])
+
+    def test_ring_buffer(self):
+        client = self._get_test_client()
+        slow_log = client.enable_slow_log(0, size=3)
+
+        for n in range(5):
+            client['people'].count({'n': n})
+
+        self.assertEqual([entry['args']['query_doc']
+                          for entry in slow_log.entries()],
+                         [{'n': 2}, {'n': 3}, {'n': 4}])
+
+    def test_explain_slow_reads(self):
+        client = self._get_test_client()
+        coll = client['people']
+        coll.insert({'_id': 'sarah@example.com', 'age': 27})
+        slow_log = client.enable_slow_log(0, explain=True)
+
+        coll.count({'age': 27})
+        coll.insert({'_id': 'mike@example.com', 'age': 30})
+        slow_log.flush()
+
+        count, insert = slow_log.entries()
+        if count['plans'] is None:
+            self.skipTest("auto_explain is not available")
+        self.assertTrue(any('people' in plan['Query Text']
+                            for plan in count['plans']))
+        self.assertIsNone(insert['plans'])
+        # the count was re-run, and the insert was not
+        self.cur.execute("select bq_count('people', '{}');")
+        self.assertEqual(self.cur.fetchall(), [(2,)])
+
+    def test_closed_with_client(self):
+        client = self._get_test_client()
+        slow_log = client.enable_slow_log(0, explain=True)
+        client['people'].count()
+        slow_log.flush()
+        capturer = slow_log._capturer
+        self.assertTrue(capturer.is_alive())
+
+        client.close()
+        self.assertFalse(capturer.is_alive())
+        self.assertIsNone(slow_log._capturer)
+
+        # no plans are captured once closed
+        event = OperationEvent('bq_count', 'people',
+                               "select bq_count('people', '{}');", None)
+        event.duration = 1
+        slow_log.finished(event)
+        self.assertIsNone(slow_log._capturer)
+        self.assertIsNone(slow_log.entries()[-1]['plans'])